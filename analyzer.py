@@ -3,59 +3,201 @@ Phantom Analyzer — AI Infrastructure Drift Analysis via Claude on Bedrock
 
 Loads structured drift data (diff, safe-state IaC, drifted IaC, Datadog
 observability context, cost reference), constructs an analysis prompt, invokes
-Claude on Amazon Bedrock via botocore SigV4, and outputs structured
+Claude on Amazon Bedrock via a pooled boto3 client, and outputs structured
 reconciliation recommendations per drift change.
 """
 
-import json
+import difflib
+import functools
+import gzip
+import hashlib
+import logging
+import math
+import mmap
 import os
+import random
 import re
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-import botocore.session
-import requests
-import yaml
-from botocore.auth import SigV4Auth
-from botocore.awsrequest import AWSRequest
-from dotenv import load_dotenv
+import boto3
+import jsonschema
+import orjson
+import urllib3
+from botocore.config import Config
+from botocore.exceptions import EventStreamError, ReadTimeoutError
 
-# Load .env from project root
-load_dotenv(Path(__file__).parent / ".env")
+# Load .env from project root. Runtimes that inject the environment directly
+# (e.g. Lambda) can set PHANTOM_SKIP_DOTENV=1 to skip the import and file read.
+if not os.environ.get("PHANTOM_SKIP_DOTENV"):
+    from dotenv import load_dotenv
+
+    load_dotenv(Path(__file__).parent / ".env")
 
 # ---------------------------------------------------------------------------
 # Configuration
 # ---------------------------------------------------------------------------
+# Console output stays human-readable prints; machine-readable events (stage
+# timings, token usage, retries) go to this logger. Run with
+# PHANTOM_LOG_JSON=1 to emit them as JSON lines on stderr.
+logger = logging.getLogger("phantom.analyzer")
+
 DUMMY_DATA_DIR = Path(__file__).parent / "dummy-data"
 OUTPUT_FILE = Path(__file__).parent / "analysis-output.json"
+RESPONSE_CACHE_DIR = Path(__file__).parent / ".phantom-cache"
+RESPONSE_CACHE_ENABLED = os.environ.get("PHANTOM_CACHE") == "1"
 
 BEDROCK_REGION = os.environ.get("BEDROCK_REGION", os.environ.get("AWS_DEFAULT_REGION"))
 
 MODEL_ID = os.environ.get("BEDROCK_MODEL_ID")
-MAX_TOKENS = 8192
-TEMPERATURE = 0.2  # low temperature for deterministic analysis
-MAX_RETRIES = 2
+# Cross-region inference profile ID, e.g. "us.anthropic.claude-sonnet-4-5-...".
+# Claude 3.7 / 4 models can only be invoked on-demand through a profile (the
+# "us." / "eu." prefixed IDs), and profiles carry far higher RPM/TPM quotas
+# than single-region model IDs. Used instead of MODEL_ID when set.
+BEDROCK_INFERENCE_PROFILE = os.environ.get("BEDROCK_INFERENCE_PROFILE_ID")
+INVOKE_MODEL_ID = BEDROCK_INFERENCE_PROFILE or MODEL_ID
+MAX_TOKENS = 8192  # ceiling; the per-request value scales with the diff
+# Greedy decoding: identical inputs yield (near-)identical JSON, which is what
+# the parser and the response cache want; phrasing of reasoning varies less.
+TEMPERATURE = 0.0
+TOP_K = 1
+MAX_RETRIES = 5
+MAX_BACKOFF_SECONDS = 30
+# Opt-in gzip of request bodies. Prompts are mostly YAML/JSON and compress
+# ~5-10x, which matters when upload bandwidth rather than model latency is
+# the bottleneck (many concurrent shards, constrained egress).
+GZIP_REQUESTS = os.environ.get("PHANTOM_GZIP_REQUESTS") == "1"
+GZIP_MIN_BYTES = 4096  # smaller bodies aren't worth the CPU
+MAX_INPUT_TOKENS = 180_000  # leave headroom under Claude's 200K context window
+
+# Errors raised mid-stream (after botocore has handed back the response)
+# are not covered by botocore's own retries.
+_RETRYABLE_STREAM_ERRORS = {
+    "throttlingException",
+    "serviceUnavailableException",
+    "internalServerException",
+    "modelStreamErrorException",
+}
+# A stalled stream surfaces as urllib3's timeout, not botocore's
+_STREAM_READ_TIMEOUTS = (ReadTimeoutError, urllib3.exceptions.ReadTimeoutError)
+
+# Large drift sets are split into shards analyzed by concurrent Bedrock calls.
+# PHANTOM_SHARD_SIZE=1 analyzes every change in its own call, so wall-clock
+# time approaches the slowest single change rather than the sum of all.
+SHARD_THRESHOLD = 4  # shard only when there are more changes than this
+SHARD_SIZE = max(1, int(os.environ.get("PHANTOM_SHARD_SIZE", "4")))  # changes per shard
+MAX_SHARD_WORKERS = 10  # concurrent Bedrock calls; below the client's pool size
 
-BEDROCK_INVOKE_URL = (
-    f"https://bedrock-runtime.{BEDROCK_REGION}.amazonaws.com"
-    f"/model/{MODEL_ID}/invoke"
-)
+# Bedrock batch inference (run_analysis_batch): S3 staging bucket and the IAM
+# role Bedrock assumes to read the input and write results.
+BATCH_BUCKET = os.environ.get("PHANTOM_BATCH_BUCKET")
+BATCH_ROLE_ARN = os.environ.get("PHANTOM_BATCH_ROLE_ARN")
+BATCH_PREFIX = os.environ.get("PHANTOM_BATCH_PREFIX", "phantom-batch")
+BATCH_POLL_SECONDS = 60
 
 
 # ---------------------------------------------------------------------------
 # Data Loading
 # ---------------------------------------------------------------------------
+_cost_ref_cache: dict = {}
+
+
+def _load_json(path: Path):
+    """
+    Parse a JSON file straight from a read-only memory map.
+    orjson reads the mapped pages directly, so the file is never copied into
+    an intermediate bytes object (large templates/context files stay cheap).
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return orjson.loads(b"")  # mmap can't map empty files; raise as usual
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            with memoryview(m) as view:
+                return orjson.loads(view)
+
+
 def load_cost_reference() -> dict:
-    """Load cost reference from dummy-data/."""
+    """
+    Load cost reference from dummy-data/.
+    The parsed dict and its prompt serialization are cached until the file's
+    mtime changes, so warm processes don't re-read or re-serialize it.
+    """
     path = DUMMY_DATA_DIR / "cost-reference.json"
-    with open(path) as f:
-        return json.load(f)
+    mtime = path.stat().st_mtime_ns
+    if _cost_ref_cache.get("mtime") != mtime:
+        data = _load_json(path)
+        _cost_ref_cache.update(mtime=mtime, data=data, serialized=_canon(data))
+    return _cost_ref_cache["data"]
+
+
+# Cost-reference sections relevant to each resource type. "pricing_note" is
+# always kept; a diff touching any unlisted type gets the full reference.
+_COST_SECTIONS_BY_TYPE = {
+    "AWS::EC2::Instance": ("ec2_instances", "ebs_storage", "demo_cost_calculation"),
+    "AWS::EC2::Volume": ("ebs_storage",),
+    "AWS::RDS::DBInstance": (
+        "rds_instances",
+        "rds_multi_az_multiplier",
+        "rds_multi_az_note",
+        "demo_cost_calculation",
+    ),
+    "AWS::EC2::NatGateway": ("other",),
+    "AWS::EC2::EIP": ("other",),
+    "AWS::ElasticLoadBalancingV2::LoadBalancer": ("other",),
+    "AWS::EC2::SecurityGroup": (),
+    "AWS::EC2::SecurityGroupIngress": (),
+    "AWS::S3::Bucket": (),
+    "AWS::IAM::Role": (),
+}
+
+
+def _prune_cost_reference(cost_reference: dict, diff: dict) -> dict:
+    """
+    Keep only the pricing sections that apply to the resource types in the
+    diff (most drift touches one or two types; the full table is the largest
+    block in the prompt).
+    """
+    types = {c["resource_type"] for c in diff["changes"]}
+    if not types <= _COST_SECTIONS_BY_TYPE.keys():
+        return cost_reference
+    keep = {"pricing_note"}
+    for resource_type in types:
+        keep.update(_COST_SECTIONS_BY_TYPE[resource_type])
+    return {k: v for k, v in cost_reference.items() if k in keep}
+
+
+def _serialize_cost_reference(cost_reference: dict) -> str:
+    """Return the cached serialization when given the cached cost reference."""
+    if cost_reference is _cost_ref_cache.get("data"):
+        return _cost_ref_cache["serialized"]
+    return _canon(cost_reference)
 
 
 # ---------------------------------------------------------------------------
 # Insights (drift) parser
 # ---------------------------------------------------------------------------
+TYPE_MAP = {
+    "ADD": "property_added",
+    "REMOVE": "property_removed",
+    "NOT_EQUAL": "property_changed",
+}
+
+# "/SecurityGroupIngress/1" → ("SecurityGroupIngress", "1"); "/InstanceType" → ("InstanceType", None)
+_PATH_RE = re.compile(r"^/*([^/]+)(?:/(\d+))?$")
+
+
+def _parse_val(s: str):
+    """Decode a drift ExpectedValue/ActualValue JSON string ("null" → None)."""
+    if s in ("null", None, ""):
+        return None
+    try:
+        return orjson.loads(s)
+    except (orjson.JSONDecodeError, TypeError):
+        return s
+
 
 def _normalise_diff(insights: dict) -> dict:
     """
@@ -73,13 +215,14 @@ def _normalise_diff(insights: dict) -> dict:
 
     Output mirrors structured-diff.json.
     """
-    TYPE_MAP = {
-        "ADD": "property_added",
-        "REMOVE": "property_removed",
-        "NOT_EQUAL": "property_changed",
-    }
+    # Local aliases keep global lookups out of the per-diff loop
+    type_get = TYPE_MAP.get
+    path_match = _PATH_RE.match
+    parse_val = _parse_val
 
     changes = []
+    append = changes.append
+    seen_resources = set()
     change_idx = 1
 
     for resource in insights.get("drifted_resources", []):
@@ -89,51 +232,37 @@ def _normalise_diff(insights: dict) -> dict:
 
         for diff in resource.get("PropertyDiffs", []):
             # PropertyPath: "/SecurityGroupIngress/1" → "SecurityGroupIngress[1]"
-            raw_path: str = diff["PropertyPath"].lstrip("/")
-            parts = raw_path.split("/")
-            if len(parts) == 2 and parts[1].isdigit():
-                property_path = f"{parts[0]}[{parts[1]}]"
-            elif len(parts) == 1:
-                property_path = parts[0]
-            else:
+            raw_path: str = diff["PropertyPath"]
+            m = path_match(raw_path)
+            if m is None:
                 # nested path: keep dot-separated for now
-                property_path = ".".join(parts)
-
-            def _parse_val(s: str):
-                if s in ("null", None, ""):
-                    return None
-                try:
-                    return json.loads(s)
-                except (json.JSONDecodeError, TypeError):
-                    return s
-
-            old_val = _parse_val(diff["ExpectedValue"])
-            new_val = _parse_val(diff["ActualValue"])
-            diff_type = TYPE_MAP.get(diff["DifferenceType"], "property_changed")
+                property_path = raw_path.lstrip("/").replace("/", ".")
+            elif m[2] is not None:
+                property_path = f"{m[1]}[{m[2]}]"
+            else:
+                property_path = m[1]
 
-            changes.append({
+            append({
                 "change_id": f"DRIFT-{change_idx:03d}",
                 "resource_type": resource_type,
                 "resource_logical_id": logical_id,
                 "resource_physical_id": physical_id,
-                "change_type": diff_type,
+                "change_type": type_get(diff["DifferenceType"], "property_changed"),
                 "property_path": property_path,
-                "old_value": old_val,
-                "new_value": new_val,
+                "old_value": parse_val(diff["ExpectedValue"]),
+                "new_value": parse_val(diff["ActualValue"]),
                 "severity_hint": "medium",
                 "category": "configuration",
             })
+            seen_resources.add(logical_id)
             change_idx += 1
 
-    # Count unique resources affected
-    resources_affected = len({c["resource_logical_id"] for c in changes})
-
     return {
         "stack_name": insights.get("stack_name", "unknown-stack"),
         "detection_timestamp": "",
         "summary": {
             "total_changes": len(changes),
-            "resources_affected": resources_affected,
+            "resources_affected": len(seen_resources),
         },
         "changes": changes,
     }
@@ -143,15 +272,21 @@ def _build_drifted_template(safe_state: dict, insights: dict) -> dict:
     """
     Construct a drifted-state template dict by patching the safe-state
     template's resource properties with ActualProperties from the insights.
+
+    Only the top-level dict, the Resources map and the drifted resources are
+    copied; every untouched subtree is shared with safe_state, which must
+    therefore not be mutated afterwards.
     """
-    import copy
-    drifted = copy.deepcopy(safe_state)
+    drifted = {**safe_state}
+    drifted["Resources"] = {**safe_state.get("Resources", {})}
 
     for resource in insights.get("drifted_resources", []):
         logical_id = resource["LogicalId"]
         actual_props = resource.get("ActualProperties", {})
-        if logical_id in drifted.get("Resources", {}):
-            drifted["Resources"][logical_id]["Properties"] = actual_props
+        if logical_id in drifted["Resources"]:
+            patched = {**drifted["Resources"][logical_id]}
+            patched["Properties"] = actual_props
+            drifted["Resources"][logical_id] = patched
 
     return drifted
 
@@ -167,10 +302,11 @@ def parse_insights(insights: dict) -> tuple[dict, dict, dict]:
     Returns:
         (structured_diff, safe_state_template, drifted_template)
     """
-    # original_template may be a JSON string or already a dict
+    # original_template may be a JSON string or already a dict; everything
+    # downstream (prompt building, rectifier) works on dicts only
     orig_tpl_raw = insights.get("original_template", "{}")
     if isinstance(orig_tpl_raw, str):
-        safe_state = json.loads(orig_tpl_raw)
+        safe_state = orjson.loads(orig_tpl_raw)
     else:
         safe_state = orig_tpl_raw
 
@@ -194,11 +330,17 @@ safe-state CloudFormation template (stored in version control) and the \
 current live state extracted via AWS IaC Generator.
 2. The SAFE-STATE TEMPLATE — the CloudFormation YAML that represents the \
 approved, version-controlled infrastructure.
-3. The DRIFTED TEMPLATE — the CloudFormation YAML representing what is \
-actually deployed in AWS right now, and what was modified via AWS Console. \
+3. The DRIFTED RESOURCES — the CloudFormation YAML definitions of only the \
+resources that appear in the diff, as actually deployed in AWS right now after \
+being modified via AWS Console. The full drifted template is the safe-state \
+template with these resources replaced; it is not sent in full. When \
+smaller, this section is instead a unified diff of those resources (safe.yaml \
+→ drifted.yaml); unchanged lines outside the diff context are as in the \
+safe-state template.
 4. DATADOG OBSERVABILITY CONTEXT — alerts, metrics, traces, logs, and \
 incident timeline from around the time the drift occurred.
-5. A COST REFERENCE — AWS pricing data for computing cost deltas.
+5. A COST REFERENCE — AWS pricing data for computing cost deltas (only the \
+sections relevant to the resource types in the diff).
 
 Your job is to analyze EACH individual drift change and produce a \
 reconciliation recommendation. For every change you MUST decide one of:
@@ -240,191 +382,610 @@ OUTPUT JSON SCHEMA:
       "refactored_value": "<any, only if recommendation is refactor, else null>"
     }
   ],
-  "aggregate_cost_delta": {
-    "monthly_usd": <float>,
-    "annualized_usd": <float>
-  },
   "overall_severity": "low | medium | high | critical",
   "executive_summary": "<string — 2-3 sentences for engineering leadership>"
 }\
 """
 
 
+# Marks the end of a stable prompt prefix that Bedrock may cache between calls.
+_CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def _canon(obj) -> str:
+    """
+    Serialize obj to canonical JSON (sorted keys, fixed separators) so that
+    logically identical inputs always produce byte-identical prompt text.
+    Output is compact: indentation only costs input tokens, and Claude reads
+    compact JSON just as well. (The report file on disk stays indented.)
+    """
+    return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS, default=str).decode()
+
+
+def _canon_yaml(obj) -> str:
+    """
+    Serialize a template to block-style YAML with sorted keys. Templates are
+    sent as YAML because it tokenizes noticeably smaller than indented JSON.
+    """
+    import yaml
+
+    return yaml.safe_dump(obj, sort_keys=True, default_flow_style=False, allow_unicode=True)
+
+
+def _drifted_resources_subset(diff: dict, drifted_state: dict) -> dict:
+    """Pick the drifted definitions of just the resources named in the diff."""
+    resources = drifted_state.get("Resources", {})
+    drifted_ids = sorted({c["resource_logical_id"] for c in diff["changes"]})
+    return {lid: resources[lid] for lid in drifted_ids if lid in resources}
+
+
+def _drifted_resources_section(diff: dict, safe_state: dict, drifted_state: dict) -> str:
+    """
+    Render the drifted resources as a unified diff against their safe-state
+    definitions, which Claude already has in the cached prefix. Falls back to
+    the full drifted definitions when the diff would not be smaller.
+    """
+    drifted_yaml = _canon_yaml(_drifted_resources_subset(diff, drifted_state))
+    safe_yaml = _canon_yaml(_drifted_resources_subset(diff, safe_state))
+    unified = "\n".join(
+        difflib.unified_diff(
+            safe_yaml.splitlines(),
+            drifted_yaml.splitlines(),
+            fromfile="safe.yaml",
+            tofile="drifted.yaml",
+            lineterm="",
+            n=3,
+        )
+    )
+    if unified and len(unified) < len(drifted_yaml):
+        return "=== DRIFTED RESOURCES (unified diff vs safe state) ===\n" + unified
+    return "=== DRIFTED RESOURCES (live AWS state) ===\n" + drifted_yaml
+
+
+def _build_prefix_blocks(safe_state: dict, cost_reference: dict) -> list[dict]:
+    """
+    Render the stable, cache-marked leading blocks of the user message
+    (cost reference, safe-state template). They depend only on the stack, so
+    callers building several messages per run render them once and reuse them.
+    """
+    cost_section = (
+        "=== COST REFERENCE (AWS pricing) ===\n"
+        + _serialize_cost_reference(cost_reference)
+    )
+    safe_section = (
+        "=== SAFE-STATE TEMPLATE (version-controlled IaC) ===\n"
+        + _canon_yaml(safe_state)
+    )
+    return [
+        {"type": "text", "text": cost_section, "cache_control": _CACHE_CONTROL},
+        {"type": "text", "text": safe_section, "cache_control": _CACHE_CONTROL},
+    ]
+
+
 def build_user_message(
     diff: dict,
-    safe_state,
-    drifted_state,
+    safe_state: dict,
+    drifted_state: dict,
     datadog_context: dict,
     cost_reference: dict,
-) -> str:
-    """Assemble the user message with all five data sources clearly delimited."""
-    sections = []
+    prefix_blocks: list[dict] | None = None,
+) -> list[dict]:
+    """
+    Assemble the user message content blocks with all five data sources
+    clearly delimited.
+
+    Stable sections (cost reference, safe-state template) come first and carry
+    cache_control markers so repeated analyses hit the prompt cache; the
+    per-drift sections (diff, drifted resources, Datadog context) come last.
+    Only the drifted resources are sent, not the whole drifted template, and
+    as a unified diff against the safe state when that is shorter.
+
+    Pass prefix_blocks from _build_prefix_blocks() to skip re-rendering the
+    stable sections. Both templates must already be dicts; parse_insights()
+    guarantees this.
+    """
+    assert isinstance(safe_state, dict) and isinstance(drifted_state, dict)
 
-    sections.append("=== STRUCTURED DIFF ===\n" + json.dumps(diff, indent=2))
-    sections.append(
-        "=== SAFE-STATE TEMPLATE (version-controlled IaC) ===\n"
-        + (json.dumps(safe_state, indent=2) if isinstance(safe_state, dict) else safe_state)
-    )
-    sections.append(
-        "=== DRIFTED TEMPLATE (live AWS state) ===\n"
-        + (json.dumps(drifted_state, indent=2) if isinstance(drifted_state, dict) else drifted_state)
-    )
-    sections.append(
+    if prefix_blocks is None:
+        prefix_blocks = _build_prefix_blocks(safe_state, cost_reference)
+
+    dynamic_sections = []
+    dynamic_sections.append("=== STRUCTURED DIFF ===\n" + _canon(diff))
+    dynamic_sections.append(_drifted_resources_section(diff, safe_state, drifted_state))
+    dynamic_sections.append(
         "=== DATADOG OBSERVABILITY CONTEXT ===\n"
-        + json.dumps(datadog_context, indent=2)
+        + _canon(datadog_context)
     )
-    sections.append(
-        "=== COST REFERENCE (AWS pricing) ===\n" + json.dumps(cost_reference, indent=2)
+    dynamic_sections.append(
+        "Analyze every change in the structured diff. Produce the JSON reconciliation report now."
     )
 
-    sections.append(
-        "Analyze every change in the structured diff. Produce the JSON reconciliation report now."
+    return [*prefix_blocks, {"type": "text", "text": "\n\n".join(dynamic_sections)}]
+
+
+def _message_length(content: list[dict]) -> int:
+    """Total characters across all text blocks of a user message."""
+    return sum(len(block["text"]) for block in content)
+
+
+def _estimate_tokens(content: list[dict]) -> int:
+    """Rough input-token estimate (~4 chars/token) for system prompt + message."""
+    return (len(SYSTEM_PROMPT) + _message_length(content)) // 4
+
+
+def _trim_safe_state(safe_state: dict, diff: dict) -> dict:
+    """Reduce the safe-state template to just the resources named in the diff."""
+    resources = safe_state.get("Resources", {})
+    drifted_ids = sorted({c["resource_logical_id"] for c in diff["changes"]})
+    return {"Resources": {lid: resources[lid] for lid in drifted_ids if lid in resources}}
+
+
+# ---------------------------------------------------------------------------
+# Response Cache
+# ---------------------------------------------------------------------------
+def _response_cache_key(
+    system_prompt: str, user_message: list[dict], max_tokens: int
+) -> str:
+    """Hash every input that determines Claude's response into a stable key."""
+    canonical = orjson.dumps(
+        {
+            "sys": system_prompt,
+            "usr": user_message,
+            "model": INVOKE_MODEL_ID,
+            "temp": TEMPERATURE,
+            "max_tokens": max_tokens,
+        },
+        option=orjson.OPT_SORT_KEYS,
     )
+    return hashlib.sha256(canonical).hexdigest()
+
+
+def _load_cached_response(key: str) -> str | None:
+    """Return the cached response text for key, or None on a miss."""
+    path = RESPONSE_CACHE_DIR / f"{key}.json"
+    try:
+        return orjson.loads(path.read_bytes())["text"]
+    except (FileNotFoundError, orjson.JSONDecodeError, KeyError):
+        return None
 
-    return "\n\n".join(sections)
+
+def _store_cached_response(key: str, text: str) -> None:
+    """Atomically write a response to the cache (temp file + rename)."""
+    RESPONSE_CACHE_DIR.mkdir(exist_ok=True)
+    path = RESPONSE_CACHE_DIR / f"{key}.json"
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_bytes(orjson.dumps({"text": text}))
+    tmp.replace(path)
 
 
 # ---------------------------------------------------------------------------
 # Bedrock Invocation
 # ---------------------------------------------------------------------------
-def _build_request_body(system_prompt: str, user_message: str) -> str:
-    """Build the Anthropic Messages API request body for Bedrock."""
-    return json.dumps(
+def _max_tokens_for(diff: dict) -> int:
+    """
+    Output budget for analyzing `diff`: ~400 tokens per change plus room for
+    the summary fields, capped at MAX_TOKENS.
+
+    Bedrock reserves input_tokens + max_tokens against the TPM quota when a
+    request starts (with output tokens weighted 5x for Claude 3.7 and later)
+    and only refunds the unused part once it finishes. An 8192 ceiling on a
+    two-change diff therefore blocks quota that concurrent shards could use.
+    """
+    return min(MAX_TOKENS, 512 + 400 * diff["summary"]["total_changes"])
+
+
+def _build_request_body(
+    system_prompt: str, user_message: list[dict], max_tokens: int = MAX_TOKENS
+) -> bytes:
+    """
+    Build the Anthropic Messages API request body for Bedrock.
+    The system prompt is sent in block form so it can be prefix-cached.
+    """
+    return orjson.dumps(
         {
             "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": MAX_TOKENS,
+            "max_tokens": max_tokens,
             "temperature": TEMPERATURE,
-            "system": system_prompt,
+            "top_k": TOP_K,
+            "system": [
+                {"type": "text", "text": system_prompt, "cache_control": _CACHE_CONTROL}
+            ],
             "messages": [{"role": "user", "content": user_message}],
         }
     )
 
 
-def invoke_claude(system_prompt: str, user_message: str) -> str:
+def _gzip_request_body(request, **kwargs):
+    """
+    botocore before-sign hook: gzip the serialized request body and set
+    Content-Encoding, so SigV4 signs the bytes that actually go on the wire.
+    """
+    body = request.body
+    if isinstance(body, bytes) and len(body) >= GZIP_MIN_BYTES:
+        request.data = gzip.compress(body, compresslevel=6)
+        request.headers["Content-Encoding"] = "gzip"
+
+
+@functools.lru_cache(maxsize=1)
+def _bedrock_client():
+    """
+    Shared bedrock-runtime client, created on first use.
+
+    The client keeps a urllib3 connection pool alive between calls (no TLS
+    handshake per invocation), resolves credentials once, and retries
+    throttled requests with botocore's adaptive retry mode (client-side rate
+    limiting plus jittered backoff). That only covers the initial request;
+    errors while reading the stream are retried by invoke_claude.
+    With PHANTOM_GZIP_REQUESTS=1, request bodies are gzipped before signing.
+    """
+    client = boto3.client(
+        "bedrock-runtime",
+        region_name=BEDROCK_REGION,
+        config=Config(
+            retries={"max_attempts": MAX_RETRIES, "mode": "adaptive"},
+            connect_timeout=10,
+            read_timeout=120,
+            tcp_keepalive=True,
+            max_pool_connections=16,
+        ),
+    )
+    if GZIP_REQUESTS:
+        client.meta.events.register(
+            "before-sign.bedrock-runtime.InvokeModelWithResponseStream",
+            _gzip_request_body,
+        )
+    return client
+
+
+def _read_response_stream(
+    stream, progress: bool = False, on_start=None
+) -> tuple[str, dict, float | None, str | None]:
+    """
+    Consume the event stream returned by invoke_model_with_response_stream.
+
+    Each "chunk" event carries an Anthropic streaming event as JSON bytes.
+    Text deltas are accumulated until message_stop arrives. With progress=True
+    a running character count is redrawn on stdout while Claude is writing.
+    on_start, if given, is called at message_start, once the prompt has been
+    processed (and any cache_control prefix written to the prompt cache).
+
+    Returns (text, usage, seconds until the first text delta or None,
+    stop_reason from message_delta, e.g. "end_turn" or "max_tokens").
+    """
+    parts: list[str] = []
+    usage: dict = {}
+    stop_reason = None
+    t0 = time.time()
+    first_token = None
+    received = 0
+
+    for event in stream:
+        chunk = event.get("chunk")
+        if chunk is None:
+            continue
+
+        payload = orjson.loads(chunk["bytes"])
+        event_type = payload.get("type")
+        if event_type == "content_block_delta":
+            text = payload["delta"].get("text", "")
+            if first_token is None:
+                first_token = time.time() - t0
+            parts.append(text)
+            received += len(text)
+            if progress:
+                sys.stdout.write(f"\r    Receiving... {received:,} chars")
+                sys.stdout.flush()
+        elif event_type == "message_start":
+            usage.update(payload["message"].get("usage", {}))
+            if on_start is not None:
+                on_start()
+        elif event_type == "message_delta":
+            usage.update(payload.get("usage", {}))
+            stop_reason = payload.get("delta", {}).get("stop_reason", stop_reason)
+        elif event_type == "message_stop":
+            if progress and received:
+                sys.stdout.write("\n")
+            return "".join(parts), usage, first_token, stop_reason
+
+    raise RuntimeError("Bedrock response stream ended before message_stop")
+
+
+def _retryable_stream_error(error: Exception) -> str | None:
+    """Error code to log if a mid-stream failure is worth retrying, else None."""
+    if isinstance(error, EventStreamError):
+        code = error.response.get("Error", {}).get("Code", "?")
+        return code if code in _RETRYABLE_STREAM_ERRORS else None
+    return "ReadTimeout"
+
+
+def _backoff_delay(attempt: int, error: Exception) -> float:
+    """
+    Jittered exponential backoff, so concurrent shard workers don't retry in
+    lockstep. A Retry-After header from Bedrock, if present, is a lower bound.
+    """
+    wait = min(MAX_BACKOFF_SECONDS, random.uniform(1, 3 * 2**attempt))
+    response = getattr(error, "response", None) or {}
+    headers = response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            wait = max(wait, float(retry_after))
+        except ValueError:
+            pass
+    return wait
+
+
+def invoke_claude(
+    system_prompt: str,
+    user_message: list[dict],
+    max_tokens: int = MAX_TOKENS,
+    progress: bool = False,
+    on_start=None,
+) -> str:
     """
-    Call Claude on Bedrock using the Messages API via botocore SigV4.
+    Call Claude on Bedrock using the streaming Messages API.
     Returns the raw text content from Claude's response.
+
+    progress=True shows a live count of received characters; leave it off
+    when several calls run concurrently, as their output would interleave.
+    on_start is passed through to _read_response_stream.
+
+    botocore retries the initial request; a throttle, model error or read
+    timeout while the stream is being read retries the whole call, up to
+    MAX_RETRIES attempts with jittered backoff. A response cut off at a
+    scaled-down max_tokens is retried once with MAX_TOKENS; one cut off at
+    MAX_TOKENS raises instead of returning incomplete JSON.
+
+    When PHANTOM_CACHE=1, responses are cached on disk keyed by a hash of the
+    prompt, model and temperature, so re-analyzing the same drift event skips
+    the Bedrock round-trip entirely. Only responses that parse and pass the
+    response schema are cached, so a bad response is retried on the next run.
     """
-    body = _build_request_body(system_prompt, user_message)
+    cache_key = None
+    if RESPONSE_CACHE_ENABLED:
+        cache_key = _response_cache_key(system_prompt, user_message, max_tokens)
+        cached = _load_cached_response(cache_key)
+        if cached is not None and _is_valid_response(cached):
+            print(f"  ✓ Response cache hit ({cache_key[:12]})")
+            logger.info("response_cache_hit", extra={"stage": "invoke", "cache_key": cache_key})
+            return cached
+
+    body = _build_request_body(system_prompt, user_message, max_tokens)
 
-    # Set up SigV4 credentials
-    session = botocore.session.get_session()
-    credentials = session.get_credentials().get_frozen_credentials()
+    client = _bedrock_client()
 
-    last_error = None
     for attempt in range(1, MAX_RETRIES + 1):
+        print(f"  → Invoking Bedrock (attempt {attempt}/{MAX_RETRIES})...")
+        t0 = time.time()
+
+        resp = client.invoke_model_with_response_stream(
+            modelId=INVOKE_MODEL_ID,
+            body=body,
+            contentType="application/json",
+            accept="application/json",
+        )
         try:
-            print(
-                f"  → Invoking Bedrock via SigV4 (attempt {attempt}/{MAX_RETRIES})..."
-            )
-            t0 = time.time()
-
-            # Sign the request with SigV4
-            aws_request = AWSRequest(
-                method="POST",
-                url=BEDROCK_INVOKE_URL,
-                data=body,
-                headers={"content-type": "application/json", "accept": "*/*"},
+            text, usage, first_token, stop_reason = _read_response_stream(
+                resp["body"], progress, on_start
             )
-            SigV4Auth(credentials, "bedrock", BEDROCK_REGION).add_auth(aws_request)
-
-            resp = requests.post(
-                BEDROCK_INVOKE_URL,
-                headers=dict(aws_request.headers),
-                data=body,
-                timeout=120,
+            break
+        except (EventStreamError, *_STREAM_READ_TIMEOUTS) as e:
+            if progress:
+                sys.stdout.write("\n")
+            code = _retryable_stream_error(e)
+            if code is None or attempt == MAX_RETRIES:
+                print(f"  ✗ Stream error: {e}")
+                raise
+            wait = _backoff_delay(attempt, e)
+            print(f"  ⚠ Stream error {code} — retrying in {wait:.1f}s...")
+            logger.info(
+                "bedrock_stream_retry",
+                extra={"stage": "invoke", "attempt": attempt, "code": code, "wait_s": round(wait, 1)},
             )
-            resp.raise_for_status()
-            result = resp.json()
+            time.sleep(wait)
 
-            elapsed = time.time() - t0
-            text = result["content"][0]["text"]
+    elapsed = time.time() - t0
 
-            # Log usage stats
-            usage = result.get("usage", {})
-            print(f"  ✓ Response received in {elapsed:.1f}s")
-            print(
-                f"    Tokens — input: {usage.get('input_tokens', '?')}, "
-                f"output: {usage.get('output_tokens', '?')}"
-            )
+    # Log usage stats
+    ttft = f" (first token after {first_token:.1f}s)" if first_token is not None else ""
+    print(f"  ✓ Response received in {elapsed:.1f}s{ttft}")
+    print(
+        f"    Tokens — input: {usage.get('input_tokens', '?')}, "
+        f"output: {usage.get('output_tokens', '?')}"
+    )
+    print(
+        f"    Prompt cache — read: {usage.get('cache_read_input_tokens', 0)}, "
+        f"write: {usage.get('cache_creation_input_tokens', 0)}"
+    )
+    logger.info(
+        "bedrock_call",
+        extra={
+            "stage": "invoke",
+            "latency_ms": int(elapsed * 1000),
+            "first_token_ms": int(first_token * 1000) if first_token is not None else None,
+            "input_tokens": usage.get("input_tokens"),
+            "output_tokens": usage.get("output_tokens"),
+            "cache_read_input_tokens": usage.get("cache_read_input_tokens", 0),
+            "cache_creation_input_tokens": usage.get("cache_creation_input_tokens", 0),
+            "max_tokens": max_tokens,
+            "stop_reason": stop_reason,
+            "attempt": attempt,
+            "botocore_retries": resp["ResponseMetadata"].get("RetryAttempts", 0),
+            "status": resp["ResponseMetadata"].get("HTTPStatusCode"),
+        },
+    )
+    if stop_reason == "max_tokens":
+        if max_tokens < MAX_TOKENS:
+            print(f"  ⚠ Output truncated at max_tokens={max_tokens}; retrying with {MAX_TOKENS}")
+            text = invoke_claude(system_prompt, user_message, MAX_TOKENS, progress, on_start)
+            # Also cache under this budget's key, so reruns skip the
+            # truncated call as well as the full-budget one
+            if cache_key is not None and _is_valid_response(text):
+                _store_cached_response(cache_key, text)
             return text
+        raise RuntimeError(f"Claude's output was truncated at max_tokens={max_tokens}")
 
-        except requests.exceptions.HTTPError as e:
-            status = e.response.status_code if e.response is not None else "?"
-            if status in (429, 503):
-                last_error = e
-                wait = 2**attempt
-                print(f"  ⚠ HTTP {status} — retrying in {wait}s...")
-                time.sleep(wait)
-            else:
-                body_text = e.response.text[:500] if e.response is not None else "N/A"
-                print(f"  ✗ HTTP {status}: {body_text}")
-                raise
-        except Exception as e:
-            last_error = e
-            if attempt < MAX_RETRIES:
-                wait = 2**attempt
-                print(f"  ⚠ Error ({e}) — retrying in {wait}s...")
-                time.sleep(wait)
-            else:
-                raise
-
-    raise RuntimeError(
-        f"Bedrock invocation failed after {MAX_RETRIES} attempts: {last_error}"
-    )
+    if cache_key is not None and _is_valid_response(text):
+        _store_cached_response(cache_key, text)
+    return text
 
 
 # ---------------------------------------------------------------------------
 # Response Parsing
 # ---------------------------------------------------------------------------
+_FENCE_RE = re.compile(r"```(?:json)?\s*\n(.*?)```", re.DOTALL)
+
+# Mirrors the OUTPUT JSON SCHEMA section of SYSTEM_PROMPT.
+_RESPONSE_SCHEMA = {
+    "type": "object",
+    "required": [
+        "stack_name",
+        "changes",
+        "overall_severity",
+        "executive_summary",
+    ],
+    "properties": {
+        "stack_name": {"type": "string"},
+        "changes": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": [
+                    "change_id",
+                    "recommendation",
+                    "confidence",
+                    "severity",
+                    "reasoning",
+                    "cost_delta_monthly_usd",
+                ],
+                "properties": {
+                    "change_id": {"type": "string"},
+                    "recommendation": {"enum": ["legitimize", "revert", "refactor"]},
+                    "confidence": {"type": "number", "minimum": 0, "maximum": 1},
+                    "severity": {"enum": ["low", "medium", "high", "critical"]},
+                    "reasoning": {"type": "string"},
+                    "cost_delta_monthly_usd": {"type": "number"},
+                },
+            },
+        },
+        "overall_severity": {"enum": ["low", "medium", "high", "critical"]},
+        "executive_summary": {"type": "string"},
+    },
+}
+_VALIDATOR = jsonschema.Draft202012Validator(_RESPONSE_SCHEMA)
+
+
+def _aggregate_cost_delta(changes: list[dict]) -> dict:
+    """Sum the per-change monthly cost deltas (Claude is not asked for totals)."""
+    monthly = round(math.fsum(c.get("cost_delta_monthly_usd") or 0 for c in changes), 2)
+    return {"monthly_usd": monthly, "annualized_usd": round(monthly * 12, 2)}
+
+
+def _response_json_text(raw: str) -> str:
+    """Return the JSON part of a response, bare or markdown-fenced."""
+    text = raw.strip()
+
+    # Claude is told not to use fences, so bare JSON is the common case and
+    # skips the regex scan entirely. Otherwise extract from the code fence.
+    if not text.startswith("{"):
+        fence_match = _FENCE_RE.search(text)
+        if fence_match:
+            text = fence_match.group(1).strip()
+    return text
+
+
+def _is_valid_response(raw: str) -> bool:
+    """True if raw parses as JSON and matches the response schema."""
+    try:
+        return _VALIDATOR.is_valid(orjson.loads(_response_json_text(raw)))
+    except orjson.JSONDecodeError:
+        return False
+
+
 def parse_analysis_response(raw: str) -> dict:
     """
     Extract and validate the JSON reconciliation report from Claude's response.
     Handles both raw JSON and markdown-fenced (```json ... ```) responses.
+    The aggregate cost delta is computed here from the per-change deltas.
     """
-    text = raw.strip()
-
-    # Try to extract from markdown code fence if present
-    fence_match = re.search(r"```(?:json)?\s*\n(.*?)```", text, re.DOTALL)
-    if fence_match:
-        text = fence_match.group(1).strip()
+    text = _response_json_text(raw)
 
     try:
-        data = json.loads(text)
-    except json.JSONDecodeError as e:
+        data = orjson.loads(text)
+    except orjson.JSONDecodeError as e:
         print(f"\n✗ Failed to parse Claude's response as JSON: {e}")
         print(f"  Raw response (first 500 chars):\n  {raw[:500]}")
         raise
 
-    # Validate required top-level keys
-    required_keys = [
-        "stack_name",
-        "changes",
-        "aggregate_cost_delta",
-        "overall_severity",
-        "executive_summary",
-    ]
-    missing = [k for k in required_keys if k not in data]
-    if missing:
-        print(f"  ⚠ Warning: Missing keys in response: {missing}")
-
-    # Validate each change has required fields
-    change_keys = [
-        "change_id",
-        "recommendation",
-        "confidence",
-        "severity",
-        "reasoning",
-        "cost_delta_monthly_usd",
-    ]
-    for i, change in enumerate(data.get("changes", [])):
-        missing_change = [k for k in change_keys if k not in change]
-        if missing_change:
-            print(f"  ⚠ Warning: Change {i} missing keys: {missing_change}")
+    # Validate against the response schema (warn only; the report is still used)
+    for error in _VALIDATOR.iter_errors(data):
+        print(f"  ⚠ Warning: {error.json_path}: {error.message}")
 
+    data["aggregate_cost_delta"] = _aggregate_cost_delta(data.get("changes", []))
     return data
 
 
+# ---------------------------------------------------------------------------
+# Sharded Analysis
+# ---------------------------------------------------------------------------
+_SEVERITY_ORDER = ["low", "medium", "high", "critical"]
+
+
+def _shard_diff(diff: dict, size: int) -> list[dict]:
+    """Split a structured diff into diffs of at most `size` changes each."""
+    changes = diff["changes"]
+    shards = []
+    for start in range(0, len(changes), size):
+        shard_changes = changes[start:start + size]
+        shards.append({
+            **diff,
+            "summary": {
+                "total_changes": len(shard_changes),
+                "resources_affected": len(
+                    {c["resource_logical_id"] for c in shard_changes}
+                ),
+            },
+            "changes": shard_changes,
+        })
+    return shards
+
+
+def _merge_reports(diff: dict, partials: list[dict]) -> dict:
+    """
+    Combine per-shard reports into a single reconciliation report.
+    Aggregate cost, overall severity and the executive summary are computed
+    locally rather than with another Bedrock call.
+    """
+    changes = [c for p in partials for c in p.get("changes", [])]
+    aggregate = _aggregate_cost_delta(changes)
+    monthly = aggregate["monthly_usd"]
+
+    severities = [p.get("overall_severity") for p in partials]
+    severities += [c.get("severity") for c in changes]
+    ranked = [_SEVERITY_ORDER.index(s) for s in severities if s in _SEVERITY_ORDER]
+    overall = _SEVERITY_ORDER[max(ranked)] if ranked else "unknown"
+
+    counts = {}
+    for c in changes:
+        rec = c.get("recommendation", "unknown")
+        counts[rec] = counts.get(rec, 0) + 1
+    breakdown = ", ".join(f"{n} {rec}" for rec, n in sorted(counts.items()))
+    sign = "+" if monthly >= 0 else "-"
+
+    return {
+        "stack_name": diff["stack_name"],
+        "analysis_timestamp": partials[0].get("analysis_timestamp", "") if partials else "",
+        "changes": changes,
+        "aggregate_cost_delta": aggregate,
+        "overall_severity": overall,
+        "executive_summary": (
+            f"Analyzed {len(changes)} drift changes in {diff['stack_name']} "
+            f"({breakdown}). Highest severity is {overall}, with a net cost "
+            f"impact of {sign}${abs(monthly):,.2f}/mo."
+        ),
+    }
+
+
 # ---------------------------------------------------------------------------
 # Pretty-Print Report
 # ---------------------------------------------------------------------------
@@ -441,70 +1002,88 @@ RECOMMENDATION_ICONS = {
 }
 
 
-def print_report(report: dict) -> None:
-    """Pretty-print the reconciliation report to stdout."""
-    print("\n" + "=" * 72)
-    print("  PHANTOM — Infrastructure Drift Reconciliation Report")
-    print("=" * 72)
+def print_report(report: dict, out=None) -> None:
+    """
+    Pretty-print the reconciliation report to `out` (default: stdout).
+    Lines are collected and emitted with a single write.
+    """
+    lines = []
+    append = lines.append
+    severity_icon = SEVERITY_ICONS.get
+    recommendation_icon = RECOMMENDATION_ICONS.get
+
+    changes = report.get("changes", [])
+    costs = [c.get("cost_delta_monthly_usd") or 0 for c in changes]
+
+    append("\n" + "=" * 72)
+    append("  PHANTOM — Infrastructure Drift Reconciliation Report")
+    append("=" * 72)
 
     severity = report.get("overall_severity", "unknown")
-    icon = SEVERITY_ICONS.get(severity, "❓")
-    print(f"\n  Stack:            {report.get('stack_name', 'N/A')}")
-    print(f"  Overall Severity: {icon} {severity.upper()}")
-    print(f"  Analyzed at:      {report.get('analysis_timestamp', 'N/A')}")
+    icon = severity_icon(severity, "❓")
+    append(f"\n  Stack:            {report.get('stack_name', 'N/A')}")
+    append(f"  Overall Severity: {icon} {severity.upper()}")
+    append(f"  Analyzed at:      {report.get('analysis_timestamp', 'N/A')}")
 
     # Aggregate cost
     cost = report.get("aggregate_cost_delta", {})
     monthly = cost.get("monthly_usd", 0)
     annual = cost.get("annualized_usd", 0)
     sign = "+" if monthly >= 0 else ""
-    print(f"  Cost Impact:      {sign}${monthly:,.2f}/mo ({sign}${annual:,.2f}/yr)")
+    append(f"  Cost Impact:      {sign}${monthly:,.2f}/mo ({sign}${annual:,.2f}/yr)")
 
-    print(f"\n  Executive Summary:")
-    print(f"  {report.get('executive_summary', 'N/A')}")
+    append(f"\n  Executive Summary:")
+    append(f"  {report.get('executive_summary', 'N/A')}")
 
     # Per-change details
-    changes = report.get("changes", [])
-    print(f"\n{'─' * 72}")
-    print(f"  CHANGE-BY-CHANGE ANALYSIS ({len(changes)} items)")
-    print(f"{'─' * 72}")
+    append(f"\n{'─' * 72}")
+    append(f"  CHANGE-BY-CHANGE ANALYSIS ({len(changes)} items)")
+    append(f"{'─' * 72}")
 
-    for change in changes:
+    for change, cost_d in zip(changes, costs):
         cid = change.get("change_id", "?")
         rec = change.get("recommendation", "?")
-        rec_icon = RECOMMENDATION_ICONS.get(rec, "❓")
+        rec_icon = recommendation_icon(rec, "❓")
         sev = change.get("severity", "?")
-        sev_icon = SEVERITY_ICONS.get(sev, "❓")
+        sev_icon = severity_icon(sev, "❓")
         conf = change.get("confidence", 0)
-        cost_d = change.get("cost_delta_monthly_usd", 0)
         resource = change.get("resource_logical_id", "?")
         prop = change.get("property_path", "?")
 
-        print(f"\n  {cid}: {resource}.{prop}")
-        print(f"    {sev_icon} Severity:       {sev.upper()}")
-        print(f"    {rec_icon} Recommendation: {rec.upper()} (confidence: {conf:.0%})")
+        append(f"\n  {cid}: {resource}.{prop}")
+        append(f"    {sev_icon} Severity:       {sev.upper()}")
+        append(f"    {rec_icon} Recommendation: {rec.upper()} (confidence: {conf:.0%})")
         if cost_d != 0:
             sign = "+" if cost_d >= 0 else ""
-            print(f"    💰 Cost delta:     {sign}${cost_d:,.2f}/mo")
+            append(f"    💰 Cost delta:     {sign}${cost_d:,.2f}/mo")
 
         old = change.get("old_value")
         new = change.get("new_value")
-        print(f"    Old → New:         {old} → {new}")
+        append(f"    Old → New:         {old} → {new}")
 
         refactored = change.get("refactored_value")
         if refactored is not None:
-            print(f"    🔧 Refactored to:  {refactored}")
+            append(f"    🔧 Refactored to:  {refactored}")
 
         reasoning = change.get("reasoning", "")
         # Wrap reasoning nicely
-        print(f"    Reasoning: {reasoning}")
+        append(f"    Reasoning: {reasoning}")
+
+    append(f"\n{'=' * 72}\n")
 
-    print(f"\n{'=' * 72}\n")
+    (out or sys.stdout).write("\n".join(lines) + "\n")
 
 
 # ---------------------------------------------------------------------------
 # Main Pipeline
 # ---------------------------------------------------------------------------
+def _write_report(report: dict) -> None:
+    """Write the report to OUTPUT_FILE atomically (temp file + rename)."""
+    tmp = OUTPUT_FILE.with_suffix(".json.tmp")
+    tmp.write_bytes(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+    tmp.replace(OUTPUT_FILE)
+
+
 def run_analysis(event: dict) -> dict:
     """
     Orchestrate the full Phantom analysis pipeline.
@@ -516,6 +1095,7 @@ def run_analysis(event: dict) -> dict:
             - observability:  Datadog context (logs, metrics, traces, events)
     """
     print("\n🔍 Phantom Analyzer — Starting drift analysis...\n")
+    t_start = time.time()
 
     insights = event["insights"]
     observability = event["observability"]
@@ -524,66 +1104,262 @@ def run_analysis(event: dict) -> dict:
     print("1/4  Parsing drift data from insights...")
     diff, safe_state, drifted_state = parse_insights(insights)
     datadog_ctx = observability
-    cost_ref = load_cost_reference()
+    cost_ref = _prune_cost_reference(load_cost_reference(), diff)
     print(
         f"     ✓ Loaded {diff['summary']['total_changes']} changes across "
         f"{diff['summary']['resources_affected']} resources"
     )
 
-    # 2. Build prompt
+    # 2. Build prompt(s) — large drift sets are sharded across parallel calls
     print("\n2/4  Constructing analysis prompt...")
-    user_message = build_user_message(
-        diff, safe_state, drifted_state, datadog_ctx, cost_ref
-    )
-    print(f"     ✓ Prompt assembled ({len(user_message):,} chars)")
+    if diff["summary"]["total_changes"] > SHARD_THRESHOLD:
+        shards = _shard_diff(diff, SHARD_SIZE)
+    else:
+        shards = [diff]
+    prefix_blocks = _build_prefix_blocks(safe_state, cost_ref)
+    user_messages = []
+    for shard in shards:
+        message = build_user_message(
+            shard, safe_state, drifted_state, datadog_ctx, cost_ref, prefix_blocks
+        )
+        estimated = _estimate_tokens(message)
+        if estimated > MAX_INPUT_TOKENS:
+            # Oversized prompts would only fail at Bedrock after a full upload
+            print(
+                f"     ⚠ Prompt ~{estimated:,} tokens exceeds {MAX_INPUT_TOKENS:,}; "
+                "sending only the drifted resources of the safe-state template "
+                "(this prompt gets its own cache prefix, not the shared one)"
+            )
+            # Without prefix_blocks the prefix is rebuilt from the trimmed state
+            message = build_user_message(
+                shard, _trim_safe_state(safe_state, shard), drifted_state,
+                datadog_ctx, cost_ref,
+            )
+            estimated = _estimate_tokens(message)
+            if estimated > MAX_INPUT_TOKENS:
+                raise RuntimeError(
+                    f"Prompt is still ~{estimated:,} tokens after trimming the "
+                    f"safe-state template (limit {MAX_INPUT_TOKENS:,}); the drifted "
+                    "resources or Datadog context are too large to analyze"
+                )
+        user_messages.append(message)
+    total_chars = sum(_message_length(m) for m in user_messages)
+    shard_note = f" across {len(shards)} shards" if len(shards) > 1 else ""
+    print(f"     ✓ Prompt assembled ({total_chars:,} chars{shard_note})")
 
     # 3. Invoke Claude on Bedrock
-    print(f"\n3/4  Invoking Claude on Bedrock ({MODEL_ID})...")
-    raw_response = invoke_claude(SYSTEM_PROMPT, user_message)
+    print(f"\n3/4  Invoking Claude on Bedrock ({INVOKE_MODEL_ID})...")
+    budgets = [_max_tokens_for(shard) for shard in shards]
+    if len(user_messages) == 1:
+        raw_responses = [
+            invoke_claude(
+                SYSTEM_PROMPT, user_messages[0], budgets[0],
+                progress=sys.stdout.isatty(),
+            )
+        ]
+    else:
+        # Shards share the cache-marked prefix (system prompt, cost reference,
+        # safe-state template). Launched all at once, every shard would pay to
+        # write it; instead start one, and release the rest as soon as its
+        # prompt is processed so they read the prefix from the prompt cache.
+        workers = min(MAX_SHARD_WORKERS, len(user_messages))
+        prefix_cached = threading.Event()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            first = pool.submit(
+                invoke_claude, SYSTEM_PROMPT, user_messages[0], budgets[0],
+                on_start=prefix_cached.set,
+            )
+            while not prefix_cached.wait(0.1) and not first.done():
+                pass
+            # A first shard that failed outright (AccessDenied, validation)
+            # would fail the same way for every other shard; don't start them
+            if first.done() and first.exception() is not None:
+                raise first.exception()
+            rest = pool.map(
+                lambda m, n: invoke_claude(SYSTEM_PROMPT, m, n),
+                user_messages[1:], budgets[1:],
+            )
+            raw_responses = [first.result(), *rest]
 
     # 4. Parse and validate
     print("\n4/4  Parsing reconciliation report...")
-    report = parse_analysis_response(raw_response)
+    partials = [parse_analysis_response(raw) for raw in raw_responses]
+    report = partials[0] if len(partials) == 1 else _merge_reports(diff, partials)
     print(f"     ✓ Parsed {len(report.get('changes', []))} change recommendations")
-
-    # Write JSON output
-    with open(OUTPUT_FILE, "w") as f:
-        json.dump(report, f, indent=2)
-    print(f"\n📄 Full JSON report saved to: {OUTPUT_FILE}")
+    logger.info(
+        "analysis_parsed",
+        extra={
+            "stage": "parse",
+            "stack_name": diff["stack_name"],
+            "shards": len(shards),
+            "changes": len(report.get("changes", [])),
+            "overall_severity": report.get("overall_severity"),
+            "monthly_usd": report["aggregate_cost_delta"]["monthly_usd"],
+        },
+    )
 
     # Pretty-print
     print_report(report)
 
-    # 5. Rectify CloudFormation template
+    # 5. Rectify CloudFormation template, then write the JSON report once
     from rectifier import rectify
-    rectified_yaml = rectify(
-        analysis=report,
-        safe_state=safe_state,
-        drifted_state=drifted_state,
-    )
+    try:
+        rectified_yaml = rectify(
+            analysis=report,
+            safe_state=safe_state,
+            drifted_state=drifted_state,
+        )
+    except Exception:
+        # Keep the analysis on disk for debugging even if rectification fails
+        _write_report(report)
+        print(f"\n📄 Partial JSON report (no rectified template) saved to: {OUTPUT_FILE}")
+        raise
     report["rectified_template"] = rectified_yaml
     print(f"\n  ✅ Rectified template generated ({len(rectified_yaml):,} chars)")
 
-    # Re-write output JSON now that rectified_template is included
-    with open(OUTPUT_FILE, "w") as f:
-        json.dump(report, f, indent=2)
+    _write_report(report)
+    print(f"\n📄 Full JSON report saved to: {OUTPUT_FILE}")
+    logger.info(
+        "analysis_complete",
+        extra={"stage": "run", "latency_ms": int((time.time() - t_start) * 1000)},
+    )
 
     return report
 
 
+# ---------------------------------------------------------------------------
+# Batch Pipeline
+# ---------------------------------------------------------------------------
+_BATCH_DONE_STATUSES = {"Completed", "PartiallyCompleted", "Failed", "Stopped", "Expired"}
+
+
+def run_analysis_batch(events: list[dict]) -> list[dict | None]:
+    """
+    Analyze many stacks at once through Bedrock batch inference.
+
+    Each event (same shape as for run_analysis) becomes one record in a JSONL
+    file staged in PHANTOM_BATCH_BUCKET; a model invocation job processes them
+    asynchronously at batch pricing, and the outputs are parsed with
+    parse_analysis_response. Bedrock enforces a minimum record count per job,
+    so this suits fleet-wide sweeps; use run_analysis for a single stack.
+
+    Returns one report per event, in order (None for records that failed).
+    """
+    if not (BATCH_BUCKET and BATCH_ROLE_ARN):
+        raise RuntimeError("PHANTOM_BATCH_BUCKET and PHANTOM_BATCH_ROLE_ARN must be set")
+
+    print(f"\n🔍 Phantom Analyzer — Batch analysis of {len(events)} stacks...\n")
+    cost_ref = load_cost_reference()
+
+    lines = []
+    for i, event in enumerate(events):
+        diff, safe_state, drifted_state = parse_insights(event["insights"])
+        user_message = build_user_message(
+            diff, safe_state, drifted_state, event["observability"],
+            _prune_cost_reference(cost_ref, diff),
+        )
+        body = _build_request_body(SYSTEM_PROMPT, user_message, _max_tokens_for(diff))
+        lines.append(
+            orjson.dumps({"recordId": f"{i:08d}", "modelInput": orjson.Fragment(body)})
+        )
+
+    job_name = f"phantom-{time.strftime('%Y%m%d-%H%M%S')}"
+    input_key = f"{BATCH_PREFIX}/input/{job_name}.jsonl"
+    output_prefix = f"{BATCH_PREFIX}/output/"
+
+    s3 = boto3.client("s3", region_name=BEDROCK_REGION)
+    s3.put_object(Bucket=BATCH_BUCKET, Key=input_key, Body=b"\n".join(lines))
+    print(f"  ✓ Staged {len(lines)} records at s3://{BATCH_BUCKET}/{input_key}")
+
+    bedrock = boto3.client("bedrock", region_name=BEDROCK_REGION)
+    job_arn = bedrock.create_model_invocation_job(
+        jobName=job_name,
+        roleArn=BATCH_ROLE_ARN,
+        modelId=INVOKE_MODEL_ID,
+        inputDataConfig={"s3InputDataConfig": {"s3Uri": f"s3://{BATCH_BUCKET}/{input_key}"}},
+        outputDataConfig={
+            "s3OutputDataConfig": {"s3Uri": f"s3://{BATCH_BUCKET}/{output_prefix}"}
+        },
+    )["jobArn"]
+    print(f"  → Submitted batch job {job_arn}")
+
+    while True:
+        job = bedrock.get_model_invocation_job(jobIdentifier=job_arn)
+        status = job["status"]
+        if status in _BATCH_DONE_STATUSES:
+            break
+        print(f"    Job status: {status} — checking again in {BATCH_POLL_SECONDS}s")
+        time.sleep(BATCH_POLL_SECONDS)
+
+    if status not in ("Completed", "PartiallyCompleted"):
+        raise RuntimeError(f"Batch job {status}: {job.get('message', 'no reason returned')}")
+    print(f"  ✓ Batch job {status}")
+    logger.info("batch_job_done", extra={"stage": "batch", "job_arn": job_arn, "status": status})
+
+    # Results land at <output prefix>/<job id>/<input file name>.out
+    job_id = job_arn.rsplit("/", 1)[-1]
+    output_key = f"{output_prefix}{job_id}/{job_name}.jsonl.out"
+    raw_output = s3.get_object(Bucket=BATCH_BUCKET, Key=output_key)["Body"].read()
+
+    reports: list[dict | None] = [None] * len(events)
+    for line in raw_output.splitlines():
+        if not line.strip():
+            continue
+        try:
+            record = orjson.loads(line)
+            index = int(record["recordId"])
+        except (KeyError, ValueError) as e:
+            print(f"  ⚠ Skipping unreadable output line: {e!r}")
+            continue
+        if "modelOutput" not in record:
+            print(f"  ⚠ Record {index} failed: {record.get('error', 'no output')}")
+            continue
+        # One malformed or truncated record must not lose the rest of the job
+        try:
+            output = record["modelOutput"]
+            if output.get("stop_reason") == "max_tokens":
+                raise ValueError("output truncated at max_tokens")
+            reports[index] = parse_analysis_response(output["content"][0]["text"])
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            print(f"  ⚠ Record {index} failed: {e!r}")
+            logger.info(
+                "batch_record_failed",
+                extra={"stage": "batch", "record": index, "error": repr(e)},
+            )
+
+    parsed = sum(r is not None for r in reports)
+    print(f"  ✓ Parsed {parsed}/{len(events)} reports")
+    logger.info(
+        "batch_parsed",
+        extra={"stage": "batch", "records": len(events), "parsed": parsed},
+    )
+    return reports
+
+
+def _configure_json_logging() -> None:
+    """Send phantom.* log records to stderr as one JSON object per line."""
+    from pythonjsonlogger.jsonlogger import JsonFormatter
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter("%(asctime)s %(name)s %(levelname)s %(message)s"))
+    root = logging.getLogger("phantom")
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+
+
 if __name__ == "__main__":
+    if os.environ.get("PHANTOM_LOG_JSON") == "1":
+        _configure_json_logging()
     # Local testing: build the event from diff-output.json + sample Datadog context
     try:
         diff_output_path = Path(__file__).parent / "diff-output.json"
         datadog_path = DUMMY_DATA_DIR / "sample-datadog-context.json"
 
-        with open(diff_output_path) as f:
-            envelope = json.load(f)
+        envelope = _load_json(diff_output_path)
         body_raw = envelope.get("body", envelope)
-        insights = json.loads(body_raw) if isinstance(body_raw, str) else body_raw
+        insights = orjson.loads(body_raw) if isinstance(body_raw, str) else body_raw
 
-        with open(datadog_path) as f:
-            observability = json.load(f)
+        observability = _load_json(datadog_path)
 
         test_event = {
             "insights": insights,
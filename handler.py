@@ -3,6 +3,7 @@ from dotenv import load_dotenv
 load_dotenv(".env")
 
 import sys  # noqa: E402
+from concurrent.futures import ThreadPoolExecutor  # noqa: E402
 from datetime import datetime, timedelta, timezone  # noqa: E402
 from utils.datadog import dd_search_logs, dd_list_traces, dd_query_metrics, dd_list_events, dd_get_monitors  # noqa: E402
 
@@ -11,42 +12,34 @@ def get_all_for_service(service: str = None, hours: int = 12, limit: int = 10) -
     """Fetch all observability data from the last N hours. If service is given, scope to it."""
     now = datetime.now(timezone.utc)
     start = now - timedelta(hours=hours)
-    iso_end = now.strftime("%Y-%m-%dT%H:%M:%SZ")
-    iso_start = start.strftime("%Y-%m-%dT%H:%M:%SZ")
+    iso_end = now.isoformat(timespec="seconds").replace("+00:00", "Z")
+    iso_start = start.isoformat(timespec="seconds").replace("+00:00", "Z")
     from_epoch = int(start.timestamp())
     to_epoch = int(now.timestamp())
 
-    log_query = f"service:{service}" if service else "*"
-    trace_query = f"service:{service}" if service else "*"
+    # Logs, traces and events share the same scope filter
+    svc_query = f"service:{service}" if service else "*"
+    log_query = trace_query = event_query = svc_query
     metric_query = (f"avg:trace.http.request.duration{{service:{service}}}"
                     if service else "avg:trace.http.request.duration{*}")
-    event_query = f"service:{service}" if service else "*"
 
-    results = {}
-
-    # Logs
-    try:
-        results["logs"] = dd_search_logs(log_query, iso_start, iso_end, limit)
-    except Exception as e:
-        results["logs"] = {"error": str(e)}
-
-    # Traces
-    try:
-        results["traces"] = dd_list_traces(trace_query, iso_start, iso_end, limit)
-    except Exception as e:
-        results["traces"] = {"error": str(e)}
+    # The four lookups are independent network round-trips; run them
+    # concurrently so the total wait is the slowest one, not the sum
+    calls = [
+        ("logs", dd_search_logs, (log_query, iso_start, iso_end, limit)),
+        ("traces", dd_list_traces, (trace_query, iso_start, iso_end, limit)),
+        ("metrics", dd_query_metrics, (metric_query, from_epoch, to_epoch)),
+        ("events", dd_list_events, (event_query, from_epoch, to_epoch)),
+    ]
+    with ThreadPoolExecutor(max_workers=len(calls)) as pool:
+        futures = [(key, pool.submit(fn, *args)) for key, fn, args in calls]
 
-    # Metrics
-    try:
-        results["metrics"] = dd_query_metrics(metric_query, from_epoch, to_epoch)
-    except Exception as e:
-        results["metrics"] = {"error": str(e)}
-
-    # Events
-    try:
-        results["events"] = dd_list_events(event_query, from_epoch, to_epoch)
-    except Exception as e:
-        results["events"] = {"error": str(e)}
+    results = {}
+    for key, fut in futures:
+        try:
+            results[key] = fut.result()
+        except Exception as e:
+            results[key] = {"error": str(e)}
 
     return results
 
@@ -1,12 +1,21 @@
-import base64
+import hashlib
 import json
 import os
+import random
 import time
-import urllib.error
-import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta, timezone
+from pathlib import Path
 
 import boto3
+import urllib3
+from botocore.config import Config
+from botocore.exceptions import ClientError, EventStreamError, ReadTimeoutError
+
+try:
+    import orjson
+except ImportError:  # not bundled in every deployment package
+    orjson = None
 
 STACK_NAME = os.environ.get("STACK_NAME", "phantom-test-stack")
 CLOUDTRAIL_HOURS = int(os.environ.get("CLOUDTRAIL_HOURS", "24"))
@@ -16,20 +25,80 @@ GITHUB_REPO = os.environ.get("GITHUB_REPO")
 GITHUB_FILE_PATH = os.environ.get("GITHUB_FILE_PATH", "drift-reports/latest.json")
 GITHUB_BASE = os.environ.get("GITHUB_BASE_BRANCH", "main")
 BEDROCK_MODEL_ID = os.environ.get("BEDROCK_MODEL_ID", "anthropic.claude-sonnet-4-5")
-
-cfn_client = boto3.client("cloudformation")
-cloudtrail_client = boto3.client("cloudtrail")
-bedrock_client = boto3.client("bedrock-runtime")
+CLOUDTRAIL_MAX_WORKERS = 16
+CLOUDTRAIL_MAX_EVENTS = 50  # per drifted resource
+# Drift comes from write calls; read-only API events are dropped
+_READ_ONLY_EVENT_PREFIXES = ("Get", "Describe", "List", "Head", "Lookup")
+DRIFT_POLL_INITIAL_SECONDS = 1.0
+DRIFT_POLL_MAX_SECONDS = 8.0
+BEDROCK_MAX_TOKENS = 8192
+# botocore retries only the initial Bedrock request; errors raised while the
+# response stream is read are retried here, up to this many attempts
+BEDROCK_STREAM_ATTEMPTS = 3
+_RETRYABLE_STREAM_ERRORS = {
+    "throttlingException",
+    "serviceUnavailableException",
+    "internalServerException",
+    "modelStreamErrorException",
+}
+# Cap on drifted resources passed on to CloudTrail and Bedrock; beyond this
+# the prompt (and lookup fan-out) grows without improving the fix
+MAX_DRIFT_FOR_LLM = int(os.environ.get("MAX_DRIFT_FOR_LLM", "25"))
+# Warm containers keep /tmp, so the original template is fetched only once
+# per stack version
+TEMPLATE_CACHE_DIR = Path(os.environ.get("TEMPLATE_CACHE_DIR", "/tmp/tpl_cache"))
+
+# Shared client settings: fail fast on a bad network path instead of burning
+# the Lambda budget on botocore's 60s default timeouts, keep connections warm
+# between invocations, and size the pool above CLOUDTRAIL_MAX_WORKERS so
+# concurrent lookups never wait on a connection checkout
+_CFG = Config(
+    max_pool_connections=32,
+    connect_timeout=3,
+    read_timeout=15,
+    retries={"max_attempts": 4, "mode": "adaptive"},
+    tcp_keepalive=True,
+)
+
+cfn_client = boto3.client(
+    "cloudformation",
+    # Drift detection polling is the most throttle-prone call
+    config=_CFG.merge(Config(retries={"max_attempts": 8, "mode": "adaptive"})),
+)
+cloudtrail_client = boto3.client("cloudtrail", config=_CFG)
+bedrock_client = boto3.client(
+    "bedrock-runtime",
+    # Generating a full template takes well over the default read timeout
+    config=_CFG.merge(Config(read_timeout=120)),
+)
+
+# Keep-alive pool for api.github.com: the calls per PR share one TLS session.
+# Retries cover idempotent requests (GET/PUT) on transient gateway errors.
+# raise_on_status=False hands the last response back once retries run out,
+# so _github_request reports the status and body instead of MaxRetryError.
+_HTTP = urllib3.PoolManager(
+    maxsize=4,
+    retries=urllib3.Retry(
+        total=3,
+        backoff_factor=0.2,
+        status_forcelist=[502, 503, 504],
+        raise_on_status=False,
+    ),
+)
 
 
 def lambda_handler(event, context):
 
     try:
         # ---------------------------------------------------------- #
-        # 1. Get stack resources                                      #
+        # 1. Get stack resources and original template (background)   #
         # ---------------------------------------------------------- #
-        resources_resp = cfn_client.list_stack_resources(StackName=STACK_NAME)
-        print(f"Stack has {len(resources_resp['StackResourceSummaries'])} resources")
+        # Neither depends on drift detection, so they run while it is
+        # being polled instead of before/after it
+        background = ThreadPoolExecutor(max_workers=2)
+        resource_count_future = background.submit(_count_stack_resources)
+        template_future = background.submit(_get_original_template)
+        background.shutdown(wait=False)
 
         # ---------------------------------------------------------- #
         # 2. Run drift detection                                      #
@@ -39,7 +108,11 @@ def lambda_handler(event, context):
         ]
 
         print(f"Drift detection started: {detection_id}")
+        print(f"Stack has {resource_count_future.result()} resources")
 
+        # Poll with capped exponential backoff plus jitter: small stacks finish
+        # within a second or two, and long detections don't hammer the API
+        delay = DRIFT_POLL_INITIAL_SECONDS
         while True:
             status = cfn_client.describe_stack_drift_detection_status(
                 StackDriftDetectionId=detection_id
@@ -58,25 +131,18 @@ def lambda_handler(event, context):
                         ),
                     },
                 )
-            time.sleep(5)
+            time.sleep(delay + random.uniform(0, 0.25 * delay))
+            delay = min(delay * 2, DRIFT_POLL_MAX_SECONDS)
 
         # ---------------------------------------------------------- #
-        # 3. Get original deployed template                           #
+        # 3. Get original deployed template (fetched in step 1)       #
         # ---------------------------------------------------------- #
-        template = cfn_client.get_template(
-            StackName=STACK_NAME, TemplateStage="Original"
-        )["TemplateBody"]
-
-        if isinstance(template, dict):
-            template = json.dumps(template, indent=2)
+        template_obj, template_str = template_future.result()
 
         # ---------------------------------------------------------- #
         # 4. Get drifted resources                                    #
         # ---------------------------------------------------------- #
-        drifts = cfn_client.describe_stack_resource_drifts(
-            StackName=STACK_NAME,
-            StackResourceDriftStatusFilters=["MODIFIED", "DELETED"],
-        )["StackResourceDrifts"]
+        drifts = _describe_resource_drifts(MAX_DRIFT_FOR_LLM)
 
         drifted_resources = [
             {
@@ -84,8 +150,8 @@ def lambda_handler(event, context):
                 "PhysicalId": d.get("PhysicalResourceId", ""),
                 "ResourceType": d["ResourceType"],
                 "DriftStatus": d["StackResourceDriftStatus"],
-                "ExpectedProperties": json.loads(d.get("ExpectedProperties", "{}")),
-                "ActualProperties": json.loads(d.get("ActualProperties", "{}")),
+                "ExpectedProperties": _parse_properties(d.get("ExpectedProperties")),
+                "ActualProperties": _parse_properties(d.get("ActualProperties")),
                 "PropertyDiffs": d.get("PropertyDifferences", []),
             }
             for d in drifts
@@ -106,37 +172,31 @@ def lambda_handler(event, context):
         # ---------------------------------------------------------- #
         # 5. Pull CloudTrail events for drifted resources only        #
         # ---------------------------------------------------------- #
-        drifted_physical_ids = {d["PhysicalId"] for d in drifted_resources}
-        start_time = datetime.now(timezone.utc) - timedelta(hours=CLOUDTRAIL_HOURS)
+        drifted_physical_ids = {
+            d["PhysicalId"] for d in drifted_resources if d["PhysicalId"]
+        }
+        # One fixed window for every lookup, so all resources are queried
+        # over the same interval
+        end_time = datetime.now(timezone.utc)
+        start_time = end_time - timedelta(hours=CLOUDTRAIL_HOURS)
         cloudtrail_events = []
 
-        for physical_id in drifted_physical_ids:
-            if not physical_id:
-                continue
-            try:
-                resp = cloudtrail_client.lookup_events(
-                    LookupAttributes=[
-                        {"AttributeKey": "ResourceName", "AttributeValue": physical_id}
-                    ],
-                    StartTime=start_time,
-                    EndTime=datetime.now(timezone.utc),
-                    MaxResults=10,
-                )
-                for e in resp.get("Events", []):
-                    cloudtrail_events.append(
-                        {
-                            "ResourceId": physical_id,
-                            "EventName": e.get("EventName"),
-                            "EventTime": str(e.get("EventTime")),
-                            "Username": e.get("Username", "unknown"),
-                            "EventSource": e.get("EventSource"),
-                            "CloudTrailEvent": json.loads(
-                                e.get("CloudTrailEvent", "{}")
-                            ),
-                        }
-                    )
-            except Exception as ct_err:
-                print(f"CloudTrail lookup failed for {physical_id}: {ct_err}")
+        # One lookup per resource; run them concurrently so the phase takes
+        # about as long as the slowest lookup rather than the sum of all
+        if drifted_physical_ids:
+            workers = min(CLOUDTRAIL_MAX_WORKERS, len(drifted_physical_ids))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    pool.submit(
+                        _lookup_cloudtrail_events, pid, start_time, end_time
+                    ): pid
+                    for pid in drifted_physical_ids
+                }
+                for future in as_completed(futures):
+                    try:
+                        cloudtrail_events.extend(future.result())
+                    except Exception as ct_err:
+                        print(f"CloudTrail lookup failed for {futures[future]}: {ct_err}")
 
         cloudtrail_events.sort(key=lambda x: x.get("EventTime", ""))
 
@@ -145,23 +205,22 @@ def lambda_handler(event, context):
         # ---------------------------------------------------------- #
         print(f"Sending drift context to Bedrock ({BEDROCK_MODEL_ID})...")
         corrected_template = _call_bedrock(
-            template, drifted_resources, cloudtrail_events
+            template_str, drifted_resources, cloudtrail_events
         )
         print("Bedrock returned corrected template ✓")
 
         # ---------------------------------------------------------- #
         # 7. Build the drift report payload                           #
         # ---------------------------------------------------------- #
+        generated_at = datetime.now(timezone.utc)
         drift_report = {
-            "generated_at": datetime.now(timezone.utc).isoformat(),
+            "generated_at": generated_at.isoformat(),
             "stack_name": STACK_NAME,
             "drift_status": status["StackDriftStatus"],
             "drift_count": len(drifted_resources),
             "drifted_resources": drifted_resources,
             "cloudtrail_events": cloudtrail_events,
-            "original_template": json.loads(template)
-            if isinstance(template, str)
-            else template,
+            "original_template": template_obj,
             "corrected_template": corrected_template,  # AI-generated fix
         }
 
@@ -170,7 +229,7 @@ def lambda_handler(event, context):
         # ---------------------------------------------------------- #
         pr_url = None
         if GITHUB_TOKEN and GITHUB_OWNER and GITHUB_REPO:
-            pr_url = _open_github_pr(drift_report)
+            pr_url = _open_github_pr(drift_report, generated_at)
         else:
             print("GitHub env vars not set — skipping PR creation")
 
@@ -189,6 +248,139 @@ def lambda_handler(event, context):
         return _response(500, {"error": str(e)})
 
 
+def _describe_resource_drifts(limit):
+    """
+    Returns up to `limit` MODIFIED/DELETED resource drifts, following
+    NextToken (botocore has no paginator for this operation).
+    """
+    drifts = []
+    kwargs = {
+        "StackName": STACK_NAME,
+        "StackResourceDriftStatusFilters": ["MODIFIED", "DELETED"],
+        "MaxResults": 100,
+    }
+    while True:
+        resp = cfn_client.describe_stack_resource_drifts(**kwargs)
+        drifts.extend(resp["StackResourceDrifts"])
+        if len(drifts) >= limit:
+            if len(drifts) > limit or resp.get("NextToken"):
+                print(f"Drift capped at {limit} resources (MAX_DRIFT_FOR_LLM)")
+            return drifts[:limit]
+        if not resp.get("NextToken"):
+            return drifts
+        kwargs["NextToken"] = resp["NextToken"]
+
+
+def _parse_properties(raw):
+    """
+    Parses a drift's Expected/ActualProperties JSON string. Missing or empty
+    ("{}", common for DELETED resources) values skip the parser.
+    """
+    if not raw or raw == "{}":
+        return {}
+    return _loads(raw)
+
+
+def _count_stack_resources():
+    """
+    Returns the number of resources in the stack, across all pages.
+    """
+    return sum(
+        len(page["StackResourceSummaries"])
+        for page in cfn_client.get_paginator("list_stack_resources").paginate(
+            StackName=STACK_NAME
+        )
+    )
+
+
+def _get_original_template():
+    """
+    Returns the original deployed template as (object, prompt string).
+    JSON templates come back already parsed; the object goes into the report
+    and a compact serialization into the prompt. YAML comes back as a string.
+
+    The template only changes when the stack is updated, so it is cached in
+    TEMPLATE_CACHE_DIR keyed by the stack ID and its last update time. If
+    the role can't call DescribeStacks, the template is fetched uncached.
+    """
+    try:
+        stack = cfn_client.describe_stacks(StackName=STACK_NAME)["Stacks"][0]
+    except ClientError as e:
+        print(f"DescribeStacks failed, skipping template cache: {e}")
+        return _template_pair(_fetch_original_template())
+
+    version = stack.get("LastUpdatedTime") or stack["CreationTime"]
+    key = hashlib.sha256(f"{stack['StackId']}|{version.isoformat()}".encode()).hexdigest()
+    cache_path = TEMPLATE_CACHE_DIR / f"{key}.json"
+
+    try:
+        template_obj = _loads(cache_path.read_bytes())["TemplateBody"]
+        print("Original template loaded from cache")
+    except (OSError, ValueError, KeyError):
+        template_obj = _fetch_original_template()
+        try:
+            TEMPLATE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            tmp = cache_path.with_suffix(".tmp")
+            tmp.write_bytes(_dumps({"TemplateBody": template_obj}))
+            tmp.replace(cache_path)
+        except OSError as cache_err:
+            print(f"Template cache write failed: {cache_err}")
+
+    return _template_pair(template_obj)
+
+
+def _fetch_original_template():
+    return cfn_client.get_template(
+        StackName=STACK_NAME, TemplateStage="Original"
+    )["TemplateBody"]
+
+
+def _template_pair(template_obj):
+    """(object, prompt string) for a TemplateBody, parsed JSON or YAML text."""
+    if isinstance(template_obj, str):
+        return template_obj, template_obj
+    return template_obj, _dumps(template_obj).decode()
+
+
+def _lookup_cloudtrail_events(physical_id, start_time, end_time):
+    """
+    Returns the recent write (non read-only) CloudTrail events for one
+    drifted resource, following pagination up to CLOUDTRAIL_MAX_EVENTS.
+    CloudTrailEvent is kept as the raw JSON string CloudTrail returns; only
+    the summary fields are used downstream, so it is never parsed here.
+    """
+    pages = cloudtrail_client.get_paginator("lookup_events").paginate(
+        LookupAttributes=[
+            {"AttributeKey": "ResourceName", "AttributeValue": physical_id}
+        ],
+        StartTime=start_time,
+        EndTime=end_time,
+        PaginationConfig={
+            "MaxItems": CLOUDTRAIL_MAX_EVENTS,
+            "PageSize": CLOUDTRAIL_MAX_EVENTS,
+        },
+    )
+    events = []
+    for page in pages:
+        for e in page.get("Events", []):
+            if e.get("ReadOnly") == "true" or e.get("EventName", "").startswith(
+                _READ_ONLY_EVENT_PREFIXES
+            ):
+                continue
+            event_time = e.get("EventTime")
+            events.append(
+                {
+                    "ResourceId": physical_id,
+                    "EventName": e.get("EventName"),
+                    "EventTime": event_time.isoformat() if event_time else "",
+                    "Username": e.get("Username", "unknown"),
+                    "EventSource": e.get("EventSource"),
+                    "CloudTrailEvent": e.get("CloudTrailEvent", "{}"),
+                }
+            )
+    return events
+
+
 def _call_bedrock(original_template, drifted_resources, cloudtrail_events):
     """
     Sends the drift context to Claude on Bedrock.
@@ -196,26 +388,23 @@ def _call_bedrock(original_template, drifted_resources, cloudtrail_events):
     """
 
     # Build a human-readable diff summary for the prompt
-    diff_summary = []
+    diff_lines = []
+    append = diff_lines.append
     for r in drifted_resources:
-        diff_summary.append(
-            f"Resource: {r['LogicalId']} ({r['ResourceType']}) — {r['DriftStatus']}"
-        )
+        append(f"Resource: {r['LogicalId']} ({r['ResourceType']}) — {r['DriftStatus']}")
         for diff in r.get("PropertyDiffs", []):
-            diff_summary.append(
+            append(
                 f"  Path: {diff['PropertyPath']}\n"
                 f"  Expected: {diff['ExpectedValue']}\n"
                 f"  Actual:   {diff['ActualValue']}\n"
                 f"  Change:   {diff['DifferenceType']}"
             )
+    diff_block = "\n".join(diff_lines)
 
-    cloudtrail_summary = ""
     if cloudtrail_events:
         cloudtrail_summary = "\n".join(
-            [
-                f"- {e['EventTime']} | {e['Username']} | {e['EventName']}"
-                for e in cloudtrail_events[:5]  # limit to last 5 events
-            ]
+            f"- {e['EventTime']} | {e['Username']} | {e['EventName']}"
+            for e in cloudtrail_events[:5]  # limit to last 5 events
         )
     else:
         cloudtrail_summary = "No CloudTrail events captured."
@@ -230,7 +419,7 @@ Your job is to update the original CloudFormation template to reflect the actual
 ```
 
 ## Drift Detected
-{chr(10).join(diff_summary)}
+{diff_block}
 
 ## CloudTrail Activity (who made the changes)
 {cloudtrail_summary}
@@ -243,21 +432,20 @@ Your job is to update the original CloudFormation template to reflect the actual
 
 Return the corrected CloudFormation template now:"""
 
-    response = bedrock_client.invoke_model(
-        modelId=BEDROCK_MODEL_ID,
-        contentType="application/json",
-        accept="application/json",
-        body=json.dumps(
-            {
-                "anthropic_version": "bedrock-2023-05-31",
-                "max_tokens": 4096,
-                "messages": [{"role": "user", "content": prompt}],
-            }
-        ),
-    )
-
-    response_body = json.loads(response["body"].read())
-    raw_text = response_body["content"][0]["text"].strip()
+    # The corrected template is about the size of the original (~3 chars per
+    # token for JSON); budget 1.5x that, since the prompt copy is compact and
+    # Claude's output may be indented, instead of a fixed ceiling
+    max_tokens = min(BEDROCK_MAX_TOKENS, 1024 + int(len(original_template) / 3 * 1.5))
+
+    raw_text, stop_reason = _invoke_bedrock(prompt, max_tokens)
+    # A truncated template never closes its JSON; retry once at the ceiling
+    if stop_reason == "max_tokens" and max_tokens < BEDROCK_MAX_TOKENS:
+        print(f"Bedrock output truncated at max_tokens={max_tokens}; retrying with {BEDROCK_MAX_TOKENS}")
+        max_tokens = BEDROCK_MAX_TOKENS
+        raw_text, stop_reason = _invoke_bedrock(prompt, max_tokens)
+    if stop_reason == "max_tokens":
+        raise RuntimeError(f"Bedrock output truncated at max_tokens={max_tokens}")
+    raw_text = raw_text.strip()
 
     # Strip any accidental markdown fences Claude might add
     if raw_text.startswith("```"):
@@ -267,15 +455,103 @@ Return the corrected CloudFormation template now:"""
     if raw_text.endswith("```"):
         raw_text = raw_text[:-3]
 
-    return json.loads(raw_text.strip())
+    return _loads(raw_text.strip())
+
+
+def _invoke_bedrock(prompt, max_tokens):
+    """
+    Streams one Bedrock completion and returns (text, stop_reason). A
+    retryable EventStreamError or read timeout while reading the stream
+    retries the whole call with jittered backoff.
+    """
+    body = _dumps(
+        {
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": max_tokens,
+            "messages": [{"role": "user", "content": prompt}],
+        }
+    )
+    for attempt in range(1, BEDROCK_STREAM_ATTEMPTS + 1):
+        response = bedrock_client.invoke_model_with_response_stream(
+            modelId=BEDROCK_MODEL_ID,
+            contentType="application/json",
+            accept="application/json",
+            body=body,
+        )
+        try:
+            return _read_json_stream(response["body"])
+        except (EventStreamError, ReadTimeoutError, urllib3.exceptions.ReadTimeoutError) as e:
+            if isinstance(e, EventStreamError):
+                code = e.response.get("Error", {}).get("Code", "?")
+                if code not in _RETRYABLE_STREAM_ERRORS:
+                    raise
+            else:
+                code = "ReadTimeout"
+            if attempt == BEDROCK_STREAM_ATTEMPTS:
+                raise
+            wait = random.uniform(1, 3 * 2**attempt)
+            print(f"Bedrock stream error {code}, retrying in {wait:.1f}s")
+            time.sleep(wait)
+
+
+def _read_json_stream(stream):
+    """
+    Collects the text deltas of a Bedrock response stream and stops as soon
+    as the first top-level JSON object is closed, so trailing tokens are
+    never waited for. Braces inside JSON strings are ignored.
 
+    Returns (text, stop_reason). stop_reason is None when reading stopped at
+    the closing brace, before Bedrock sent it.
+    """
+    parts = []
+    stop_reason = None
+    depth = 0
+    in_string = False
+    escaped = False
+    try:
+        for event in stream:
+            chunk = event.get("chunk")
+            if chunk is None:
+                continue
+            payload = _loads(chunk["bytes"])
+            event_type = payload.get("type")
+            if event_type == "message_stop":
+                break
+            if event_type == "message_delta":
+                stop_reason = payload.get("delta", {}).get("stop_reason", stop_reason)
+                continue
+            if event_type != "content_block_delta":
+                continue
 
-def _open_github_pr(drift_report):
+            text = payload["delta"].get("text", "")
+            parts.append(text)
+            for ch in text:
+                if in_string:
+                    if escaped:
+                        escaped = False
+                    elif ch == "\\":
+                        escaped = True
+                    elif ch == '"':
+                        in_string = False
+                elif ch == '"' and depth:
+                    in_string = True
+                elif ch == "{":
+                    depth += 1
+                elif ch == "}" and depth:
+                    depth -= 1
+                    if not depth:
+                        return "".join(parts), stop_reason
+    finally:
+        stream.close()
+    return "".join(parts), stop_reason
+
+
+def _open_github_pr(drift_report, generated_at):
     """
     Pushes the AI-corrected CFN template (not the drift report JSON)
     to a new branch and opens a PR.
     """
-    timestamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    timestamp = generated_at.strftime("%Y%m%d-%H%M%S")
     branch = f"drift/{timestamp}"
     api_base = f"https://api.github.com/repos/{GITHUB_OWNER}/{GITHUB_REPO}"
     headers = {
@@ -284,65 +560,86 @@ def _open_github_pr(drift_report):
         "Accept": "application/vnd.github.v3+json",
     }
 
-    # Step 1 — get base branch SHA
-    base_sha = _github_request(
-        "GET", f"{api_base}/git/ref/heads/{GITHUB_BASE}", headers
-    )["object"]["sha"]
+    cfn_file_path = os.environ.get(
+        "CFN_TEMPLATE_PATH", "cloudformation/infrastructure_cft.json"
+    )
+
+    corrected_content = _dumps(drift_report["corrected_template"], indent=True).decode()
+    drifted_names = [d["LogicalId"] for d in drift_report["drifted_resources"]]
+
+    # Commit through the Git Data API: the template is uploaded once as a raw
+    # UTF-8 blob (no base64, no lookup of the existing file's SHA) and the new
+    # branch is created pointing straight at the commit
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        # Step 1 (in the background) — upload the corrected template as a blob
+        blob_future = pool.submit(
+            _github_request,
+            "POST",
+            f"{api_base}/git/blobs",
+            headers,
+            {"content": corrected_content, "encoding": "utf-8"},
+        )
+
+        # Step 2 — get base branch SHA and its tree
+        base_sha = _github_request(
+            "GET", f"{api_base}/git/ref/heads/{GITHUB_BASE}", headers
+        )["object"]["sha"]
+        base_tree = _github_request(
+            "GET", f"{api_base}/git/commits/{base_sha}", headers
+        )["tree"]["sha"]
+
+        blob_sha = blob_future.result()["sha"]
+
+    # Step 3 — new tree with the template replaced, and a commit on top of base
+    tree_sha = _github_request(
+        "POST",
+        f"{api_base}/git/trees",
+        headers,
+        {
+            "base_tree": base_tree,
+            "tree": [
+                {"path": cfn_file_path, "mode": "100644", "type": "blob", "sha": blob_sha}
+            ],
+        },
+    )["sha"]
+    commit_sha = _github_request(
+        "POST",
+        f"{api_base}/git/commits",
+        headers,
+        {
+            "message": f"fix: reconcile drift in {', '.join(drifted_names)} [{timestamp}]",
+            "tree": tree_sha,
+            "parents": [base_sha],
+        },
+    )["sha"]
 
-    # Step 2 — create new branch
+    # Step 4 — create the branch at the new commit
     _github_request(
         "POST",
         f"{api_base}/git/refs",
         headers,
         {
             "ref": f"refs/heads/{branch}",
-            "sha": base_sha,
+            "sha": commit_sha,
         },
     )
-    print(f"Created branch: {branch}")
-
-    # Step 3 — check if CFN template file already exists
-    cfn_file_path = os.environ.get(
-        "CFN_TEMPLATE_PATH", "cloudformation/infrastructure_cft.json"
-    )
-    file_sha = None
-    try:
-        existing = _github_request(
-            "GET", f"{api_base}/contents/{cfn_file_path}?ref={GITHUB_BASE}", headers
-        )
-        file_sha = existing.get("sha")
-    except Exception:
-        pass
-
-    # Step 4 — push the corrected template to the new branch
-    corrected_content = json.dumps(drift_report["corrected_template"], indent=2)
-    encoded = base64.b64encode(corrected_content.encode()).decode()
-
-    drifted_names = [d["LogicalId"] for d in drift_report["drifted_resources"]]
-    put_body = {
-        "message": f"fix: reconcile drift in {', '.join(drifted_names)} [{timestamp}]",
-        "content": encoded,
-        "branch": branch,
-    }
-    if file_sha:
-        put_body["sha"] = file_sha
-
-    _github_request("PUT", f"{api_base}/contents/{cfn_file_path}", headers, put_body)
-    print(f"Pushed corrected template to branch: {branch}")
+    print(f"Pushed corrected template to new branch: {branch}")
 
     # Step 5 — open the PR with a rich description
-    diffs_md = "\n".join(
-        [
-            f"- `{d['LogicalId']}` ({d['ResourceType']}) — **{d['DriftStatus']}**\n"
-            + "\n".join(
-                [
-                    f"  - `{p['PropertyPath']}`: `{p['ExpectedValue']}` → `{p['ActualValue']}` ({p['DifferenceType']})"
-                    for p in d.get("PropertyDiffs", [])
-                ]
+    # One flat list of lines, joined once
+    diff_lines = []
+    append = diff_lines.append
+    for d in drift_report["drifted_resources"]:
+        append(f"- `{d['LogicalId']}` ({d['ResourceType']}) — **{d['DriftStatus']}**")
+        property_diffs = d.get("PropertyDiffs", [])
+        if not property_diffs:
+            append("")
+        for p in property_diffs:
+            append(
+                f"  - `{p['PropertyPath']}`: `{p['ExpectedValue']}` → "
+                f"`{p['ActualValue']}` ({p['DifferenceType']})"
             )
-            for d in drift_report["drifted_resources"]
-        ]
-    )
+    diffs_md = "\n".join(diff_lines)
 
     pr = _github_request(
         "POST",
@@ -372,18 +669,32 @@ def _open_github_pr(drift_report):
 
 
 def _github_request(method, url, headers, body=None):
-    data = json.dumps(body).encode() if body else None
-    req = urllib.request.Request(url, data=data, headers=headers, method=method)
-    try:
-        with urllib.request.urlopen(req) as resp:
-            return json.loads(resp.read().decode())
-    except urllib.error.HTTPError as e:
-        raise Exception(f"GitHub API error {e.code}: {e.read().decode()}")
+    data = _dumps(body) if body else None
+    resp = _HTTP.request(method, url, body=data, headers=headers)
+    if resp.status >= 400:
+        raise Exception(f"GitHub API error {resp.status}: {resp.data.decode()}")
+    return _loads(resp.data)
+
+
+def _dumps(obj, indent=False):
+    """
+    Serializes obj to JSON bytes, compact or 2-space indented, with orjson
+    when it's available. Datetimes and other non-JSON values become strings.
+    """
+    if orjson is not None:
+        option = orjson.OPT_INDENT_2 if indent else 0
+        return orjson.dumps(obj, default=str, option=option)
+    if indent:
+        return json.dumps(obj, indent=2, default=str).encode()
+    return json.dumps(obj, separators=(",", ":"), default=str).encode()
+
+
+_loads = orjson.loads if orjson is not None else json.loads
 
 
 def _response(status_code, body):
     return {
         "statusCode": status_code,
         "headers": {"Content-Type": "application/json"},
-        "body": json.dumps(body, default=str),
+        "body": _dumps(body).decode(),
     }
@@ -24,12 +24,18 @@ Or imported and called from analyzer.py:
 
 import copy
 import json
-import re
 import sys
+import warnings
+from collections import defaultdict
 from pathlib import Path
 
 import yaml
 
+try:
+    import orjson
+except ImportError:  # standalone use without the analyzer's dependencies
+    orjson = None
+
 # ---------------------------------------------------------------------------
 # Paths (all relative to this file's directory)
 # ---------------------------------------------------------------------------
@@ -49,7 +55,7 @@ DEFAULT_OUTPUT_PATH = _ROOT / "rectified-template.yaml"
 class _CFNode:
     """
     Wraps a CloudFormation intrinsic function (e.g. !Ref, !GetAtt).
-    Uses a regular class (not str subclass) so deepcopy works reliably.
+    Uses a regular class (not str subclass) so copying works reliably.
     """
     __slots__ = ("cf_tag", "value")
 
@@ -58,18 +64,47 @@ class _CFNode:
         self.value = value
 
     def __deepcopy__(self, memo):
-        import copy
-        return _CFNode(self.cf_tag, copy.deepcopy(self.value, memo))
+        return _CFNode(self.cf_tag, _fast_clone(self.value))
 
     def __repr__(self):
         return f"_CFNode({self.cf_tag!r}, {self.value!r})"
 
 
-class _CFLoader(yaml.SafeLoader):
+# libyaml's C scanner/emitter is ~10x faster than the pure-Python ones; the
+# constructors and representers registered below work with either.
+if not yaml.__with_libyaml__:
+    warnings.warn("PyYAML built without libyaml; using the slower pure-Python loader")
+_BaseLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+_BaseDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+
+# Immutable scalars the YAML/JSON loaders produce; shared rather than copied
+_ATOMIC_TYPES = frozenset({str, int, float, bool, type(None)})
+
+
+def _fast_clone(x):
+    """
+    Deep-copy a parsed template. Templates are trees of dict / list / _CFNode
+    / scalars, so this skips deepcopy's generic dispatch and memo bookkeeping;
+    anything unexpected (dates, sets) falls back to copy.deepcopy.
+    """
+    t = type(x)
+    if t is dict:
+        return {k: _fast_clone(v) for k, v in x.items()}
+    if t is list:
+        return [_fast_clone(v) for v in x]
+    if t in _ATOMIC_TYPES:
+        return x
+    if t is _CFNode:
+        return _CFNode(x.cf_tag, _fast_clone(x.value))
+    return copy.deepcopy(x)
+
+
+class _CFLoader(_BaseLoader):
     pass
 
 
-class _CFDumper(yaml.Dumper):
+class _CFDumper(_BaseDumper):
     pass
 
 
@@ -85,10 +120,19 @@ def _node_constructor(cf_tag: str):
     return _fn
 
 
+# Intrinsics whose short form only ever takes a plain scalar. !GetAtt and
+# !Sub also accept lists, and !Base64 / !ImportValue / !GetAZs accept nested
+# functions, so only !Ref (by far the most common tag) qualifies.
+_SCALAR_CF_TAGS = frozenset({"!Ref"})
+
+
 def _node_representer(dumper, data: _CFNode):
     val = data.value
-    if isinstance(val, str):
+    if data.cf_tag in _SCALAR_CF_TAGS:
         return dumper.represent_scalar(data.cf_tag, val)
+    if isinstance(val, str):
+        # Quote empty values (!GetAZs '') — a bare tag reads as ambiguous
+        return dumper.represent_scalar(data.cf_tag, val, style="'" if not val else None)
     elif isinstance(val, list):
         return dumper.represent_sequence(data.cf_tag, val)
     else:
@@ -112,30 +156,52 @@ def load_template(path: Path) -> dict:
         return yaml.load(f, Loader=_CFLoader)
 
 
+def render_template_to(data: dict, stream) -> None:
+    """Serialise a template dict as YAML straight into a text stream."""
+    yaml.dump(data, stream, Dumper=_CFDumper, default_flow_style=False, allow_unicode=True)
+
+
 def render_template(data: dict) -> str:
     """Serialise a template dict to a YAML string (no file I/O)."""
     return yaml.dump(data, Dumper=_CFDumper, default_flow_style=False, allow_unicode=True)
 
 
 def save_template(data: dict, path: Path) -> None:
-    """Write a template dict to a YAML file on disk."""
+    """Write a template dict to a YAML file on disk, without an in-memory copy."""
     with open(path, "w") as f:
-        f.write(render_template(data))
+        render_template_to(data, f)
+
+
+_loads = orjson.loads if orjson is not None else json.loads
 
 
 def load_analysis(path: Path) -> dict:
-    with open(path) as f:
-        return json.load(f)
+    with open(path, "rb") as f:
+        return _loads(f.read())
 
 
 # ---------------------------------------------------------------------------
 # Property-path helpers
 # ---------------------------------------------------------------------------
 
-# Matches "Tags[SomeKey]" — a tag lookup
-_TAG_PATH_RE = re.compile(r"^Tags\[(.+)\]$")
-# Matches "SomeProp[0]" — a list index access
-_LIST_PATH_RE = re.compile(r"^(.+)\[(\d+)\]$")
+# Property-path kinds returned by _classify
+_SIMPLE, _LIST, _TAG = "simple", "list", "tag"
+
+
+def _classify(path: str) -> tuple:
+    """
+    Parse a property path once into (kind, key, arg) with plain string ops:
+      "Tags[SomeKey]" → (_TAG, "Tags", "SomeKey")    — a tag lookup
+      "SomeProp[0]"   → (_LIST, "SomeProp", 0)        — a list index access
+      anything else   → (_SIMPLE, path, None)
+    """
+    if path.endswith("]"):
+        if path.startswith("Tags[") and len(path) > 6:
+            return _TAG, "Tags", path[5:-1]
+        i = path.rfind("[")
+        if i > 0 and path[i + 1:-1].isdecimal():
+            return _LIST, path[:i], int(path[i + 1:-1])
+    return _SIMPLE, path, None
 
 
 def _get_resource_props(template: dict, logical_id: str) -> dict:
@@ -165,21 +231,19 @@ def _dict_to_tags(tags_dict: dict) -> list:
     return [{"Key": k, "Value": v} for k, v in tags_dict.items()]
 
 
-def _get_tag_value(props: dict, tag_key: str):
-    tags = _tags_as_dict(props.get("Tags", []))
+# Tag edits work on a {Key: Value} dict that apply_recommendations builds
+# once per resource and converts back to a Tags list after all its changes.
+
+def _get_tag_value(tags: dict, tag_key: str):
     return tags.get(tag_key)
 
 
-def _set_tag_value(props: dict, tag_key: str, value) -> None:
-    tags = _tags_as_dict(props.get("Tags", []))
+def _set_tag_value(tags: dict, tag_key: str, value) -> None:
     tags[tag_key] = value
-    props["Tags"] = _dict_to_tags(tags)
 
 
-def _del_tag(props: dict, tag_key: str) -> None:
-    tags = _tags_as_dict(props.get("Tags", []))
+def _del_tag(tags: dict, tag_key: str) -> None:
     tags.pop(tag_key, None)
-    props["Tags"] = _dict_to_tags(tags)
 
 
 def _get_list_element(props: dict, list_key: str, index: int):
@@ -189,8 +253,9 @@ def _get_list_element(props: dict, list_key: str, index: int):
 
 def _set_list_element(props: dict, list_key: str, index: int, value) -> None:
     lst = props.setdefault(list_key, [])
-    while len(lst) <= index:
-        lst.append(None)
+    n = len(lst)
+    if index >= n:
+        lst.extend([None] * (index + 1 - n))
     lst[index] = value
 
 
@@ -205,28 +270,27 @@ def _del_list_element(props: dict, list_key: str, index: int) -> None:
 # Core: apply a single change recommendation
 # ---------------------------------------------------------------------------
 
-REVERT_TEXT = {
-    "revert": "REVERTED",
-    "legitimize": "LEGITIMIZED",
-    "refactor": "REFACTORED",
-}
-
-
 def _apply_change(
     result_props: dict,
     safe_props: dict,
     drifted_props: dict,
     change: dict,
-) -> str:
+    tag_dict: dict | None = None,
+    target: tuple | None = None,
+) -> tuple[str, str]:
     """
     Apply one change recommendation to result_props (mutated in place).
-    Returns a short summary string for logging.
+    Tag changes are applied to tag_dict, the resource's Tags as a dict,
+    which the caller writes back to result_props. target is the path's
+    _classify() result, if the caller already has it.
+    Returns (RECOMMENDATION, detail) for the caller's log line.
     """
     path: str = change["property_path"]
     rec: str = change["recommendation"]
     old_val = change["old_value"]    # safe-state value
     new_val = change["new_value"]    # drifted value
     refactored = change.get("refactored_value")
+    verb = rec.upper()
 
     # ---- Determine what the final value should be -------------------------
     if rec == "revert":
@@ -239,43 +303,42 @@ def _apply_change(
         final = refactored       # optimised middle-ground
         is_delete = (refactored is None)
     else:
-        return f"  ⚠ Unknown recommendation '{rec}', skipping"
+        return verb, f"⚠ Unknown recommendation '{rec}', skipping"
 
     # ---- Dispatch by path type -------------------------------------------
-    tag_match = _TAG_PATH_RE.match(path)
-    list_match = _LIST_PATH_RE.match(path)
+    kind, key, arg = target or _classify(path)
 
-    if tag_match:
+    if kind is _TAG:
         # Tags[SomeKey]
-        tag_key = tag_match.group(1)
+        tag_key = arg
         if is_delete:
-            _del_tag(result_props, tag_key)
-            return f"  {REVERT_TEXT[rec]}: Tags[{tag_key}] → (removed)"
+            _del_tag(tag_dict, tag_key)
+            return verb, f"Tags[{tag_key}] → (removed)"
         else:
-            _set_tag_value(result_props, tag_key, final)
-            return f"  {REVERT_TEXT[rec]}: Tags[{tag_key}] → {final!r}"
+            _set_tag_value(tag_dict, tag_key, final)
+            return verb, f"Tags[{tag_key}] → {final!r}"
 
-    elif list_match:
+    elif kind is _LIST:
         # SomeProp[N]
-        list_key = list_match.group(1)
-        index = int(list_match.group(2))
+        list_key = key
+        index = arg
 
         if is_delete:
             # old_value was None → element was added in drift → revert means remove it
             _del_list_element(result_props, list_key, index)
-            return f"  {REVERT_TEXT[rec]}: {list_key}[{index}] → (removed)"
+            return verb, f"{list_key}[{index}] → (removed)"
         else:
             _set_list_element(result_props, list_key, index, final)
-            return f"  {REVERT_TEXT[rec]}: {list_key}[{index}] → {final!r}"
+            return verb, f"{list_key}[{index}] → {final!r}"
 
     else:
         # Simple property key
         if is_delete:
             _del_simple(result_props, path)
-            return f"  {REVERT_TEXT[rec]}: {path} → (removed)"
+            return verb, f"{path} → (removed)"
         else:
             _set_simple(result_props, path, final)
-            return f"  {REVERT_TEXT[rec]}: {path}: {old_val!r} → {final!r}"
+            return verb, f"{path}: {old_val!r} → {final!r}"
 
 
 # ---------------------------------------------------------------------------
@@ -286,6 +349,7 @@ def apply_recommendations(
     safe_state: dict,
     drifted_state: dict,
     analysis: dict,
+    verbose: bool = True,
 ) -> dict:
     """
     Merge safe-state and drifted templates according to analysis recommendations.
@@ -296,37 +360,88 @@ def apply_recommendations(
       - This naturally handles "no changes outside the diff" correctly since
         un-drifted resources are already identical in both templates.
 
+    Progress lines are buffered and written to stdout in one go at the end
+    (or not at all with verbose=False).
+
     Returns a new dict (deep-copied; originals are not mutated).
     """
-    result = copy.deepcopy(safe_state)
+    result = _fast_clone(safe_state)
 
     changes = analysis.get("changes", [])
-    print(f"\n5/5  Rectifying CloudFormation template ({len(changes)} changes)...\n")
+    log: list[str] = [f"\n5/5  Rectifying CloudFormation template ({len(changes)} changes)...\n"]
 
-    by_resource: dict[str, list] = {}
+    # Classify each path once here; the tuple travels beside the change so
+    # the analysis dict itself is left untouched
+    by_resource: defaultdict[str, list] = defaultdict(list)
     for change in changes:
-        rid = change["resource_logical_id"]
-        by_resource.setdefault(rid, []).append(change)
-
-    for logical_id, resource_changes in by_resource.items():
-        print(f"  [{logical_id}]")
-        try:
-            result_props = _get_resource_props(result, logical_id)
-            safe_props = _get_resource_props(safe_state, logical_id)
-            drifted_props = _get_resource_props(drifted_state, logical_id)
-        except KeyError:
-            print(f"  ⚠ Resource '{logical_id}' not found in template, skipping")
-            continue
-
-        for change in resource_changes:
-            summary = _apply_change(result_props, safe_props, drifted_props, change)
-            cid = change["change_id"]
-            rec = change["recommendation"].upper()
-            print(f"    {cid} [{rec}]{summary[summary.index(':'):]}")
+        by_resource[change["resource_logical_id"]].append(
+            (change, _classify(change["property_path"]))
+        )
+
+    try:
+        for logical_id, resource_changes in by_resource.items():
+            log.append(f"  [{logical_id}]")
+            try:
+                result_props = _get_resource_props(result, logical_id)
+                safe_props = _get_resource_props(safe_state, logical_id)
+                drifted_props = _get_resource_props(drifted_state, logical_id)
+            except KeyError:
+                log.append(f"  ⚠ Resource '{logical_id}' not found in template, skipping")
+                continue
+
+            # Convert Tags to a dict once for all of this resource's tag edits
+            has_tag_changes = any(t[0] is _TAG for _, t in resource_changes)
+            tag_dict = _tags_as_dict(result_props.get("Tags", [])) if has_tag_changes else None
+
+            for change, target in resource_changes:
+                verb, detail = _apply_change(
+                    result_props, safe_props, drifted_props, change, tag_dict, target
+                )
+                log.append(f"    {change['change_id']} [{verb}]: {detail}")
+
+            if has_tag_changes:
+                result_props["Tags"] = _dict_to_tags(tag_dict)
+    finally:
+        if verbose:
+            sys.stdout.write("\n".join(log) + "\n")
 
     return result
 
 
+def _rectified_dict(
+    analysis: dict | None,
+    safe_state: dict | None,
+    drifted_state: dict | None,
+    safe_state_path: Path,
+    drifted_path: Path,
+    analysis_path: Path,
+    verbose: bool = True,
+) -> dict:
+    """Load whatever wasn't passed in and return the rectified template dict."""
+    if analysis is None:
+        if verbose:
+            print(f"  → Loading analysis from {analysis_path}")
+        analysis = load_analysis(analysis_path)
+
+    if safe_state is None:
+        safe_state = load_template(safe_state_path)
+    if drifted_state is None:
+        drifted_state = load_template(drifted_path)
+
+    rectified = apply_recommendations(safe_state, drifted_state, analysis, verbose)
+
+    # Update the Description field to reflect rectified state
+    original_desc = rectified.get("Description", "")
+    if "(Rectified)" not in original_desc:
+        rectified["Description"] = original_desc.replace(
+            "(Safe State)", "(Rectified)"
+        ).replace(
+            "Safe State", "Rectified"
+        ) + " — Rectified by Phantom"
+
+    return rectified
+
+
 def rectify(
     analysis: dict | None = None,
     # Accept either a pre-parsed dict or a file path for both templates.
@@ -337,37 +452,22 @@ def rectify(
     safe_state_path: Path = DEFAULT_SAFE_STATE_PATH,
     drifted_path: Path = DEFAULT_DRIFTED_PATH,
     analysis_path: Path = DEFAULT_ANALYSIS_PATH,
+    verbose: bool = True,
 ) -> str:
     """
     Orchestrate the full rectification pipeline.
 
     Templates can be provided as pre-parsed dicts (from analyzer.py) or
     resolved from file paths (standalone mode). Analysis dict takes priority
-    over analysis_path.
+    over analysis_path. verbose=False suppresses the progress output.
 
     Returns the rectified CloudFormation template as a YAML string.
     No files are written to disk.
     """
-    if analysis is None:
-        print(f"  → Loading analysis from {analysis_path}")
-        analysis = load_analysis(analysis_path)
-
-    if safe_state is None:
-        safe_state = load_template(safe_state_path)
-    if drifted_state is None:
-        drifted_state = load_template(drifted_path)
-
-    rectified = apply_recommendations(safe_state, drifted_state, analysis)
-
-    # Update the Description field to reflect rectified state
-    original_desc = rectified.get("Description", "")
-    if "(Rectified)" not in original_desc:
-        rectified["Description"] = original_desc.replace(
-            "(Safe State)", "(Rectified)"
-        ).replace(
-            "Safe State", "Rectified"
-        ) + " — Rectified by Phantom"
-
+    rectified = _rectified_dict(
+        analysis, safe_state, drifted_state,
+        safe_state_path, drifted_path, analysis_path, verbose,
+    )
     return render_template(rectified)
 
 
@@ -383,7 +483,10 @@ def _standalone():
     print()
 
     try:
-        yaml_str = rectify()
+        rectified = _rectified_dict(
+            None, None, None,
+            DEFAULT_SAFE_STATE_PATH, DEFAULT_DRIFTED_PATH, DEFAULT_ANALYSIS_PATH,
+        )
     except FileNotFoundError as e:
         print(f"\n✗ File not found: {e}")
         print("  Tip: run analyzer.py first to generate analysis-output.json")
@@ -392,7 +495,9 @@ def _standalone():
     print("=" * 60)
     print("  RECTIFIED TEMPLATE (YAML)")
     print("=" * 60)
-    print(yaml_str)
+    # Emit straight to stdout rather than building the whole YAML string first
+    render_template_to(rectified, sys.stdout)
+    print()
 
 
 if __name__ == "__main__":
@@ -1,12 +1,45 @@
 from typing import Optional
 
+import functools
+import json
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-DD_BASE = "https://api.datadoghq.com/api"
+try:
+    import orjson
+except ImportError:  # optional; falls back to the stdlib parser
+    orjson = None
 
+DD_BASE = "https://api.datadoghq.com/api"
 
+# One keep-alive pool for every call: saves a TCP+TLS handshake per request.
+# Throttled / 5xx responses are retried on the open connection; the search
+# endpoints are POST but read-only, so they are safe to retry too.
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    max_retries=Retry(
+        total=2,
+        backoff_factor=0.2,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset({"GET", "POST"}),
+        raise_on_status=False,
+    ),
+))
+
+
+# Log and span searches can return MBs of JSON; orjson parses the raw
+# (already gunzipped) body much faster than resp.json()
+_loads = orjson.loads if orjson is not None else json.loads
+
+
+@functools.lru_cache(maxsize=1)
 def _headers() -> dict:
+    # Keys don't change within a process; build the dict once, on first use
+    # (after load_dotenv). A missing key raises KeyError and isn't cached.
     return {
         "DD-API-KEY": os.environ["DD_API_KEY"],
         "DD-APPLICATION-KEY": os.environ["DD_APP_KEY"],
@@ -28,9 +61,9 @@ def dd_search_logs(query: str, time_from: str, time_to: str, limit: int = 50) ->
         "sort": "-timestamp",
         "page": {"limit": limit},
     }
-    resp = requests.post(f"{DD_BASE}/v2/logs/events/search", headers=_headers(), json=payload)
+    resp = _SESSION.post(f"{DD_BASE}/v2/logs/events/search", headers=_headers(), json=payload)
     resp.raise_for_status()
-    return resp.json()
+    return _loads(resp.content)
 
 
 def dd_list_traces(query: str, time_from: str, time_to: str, limit: int = 50) -> dict:
@@ -52,10 +85,10 @@ def dd_list_traces(query: str, time_from: str, time_to: str, limit: int = 50) ->
             "type": "search_request",
         }
     }
-    resp = requests.post(f"{DD_BASE}/v2/spans/events/search", headers=_headers(), json=payload)
+    resp = _SESSION.post(f"{DD_BASE}/v2/spans/events/search", headers=_headers(), json=payload)
     if not resp.ok:
         raise RuntimeError(f"{resp.status_code}: {resp.text}")
-    return resp.json()
+    return _loads(resp.content)
 
 
 def dd_query_metrics(query: str, from_ts: int, to_ts: int) -> dict:
@@ -66,13 +99,13 @@ def dd_query_metrics(query: str, from_ts: int, to_ts: int) -> dict:
         from_ts: Unix epoch start (seconds).
         to_ts:   Unix epoch end (seconds).
     """
-    resp = requests.get(
+    resp = _SESSION.get(
         f"{DD_BASE}/v1/query",
         headers=_headers(),
         params={"query": query, "from": from_ts, "to": to_ts},
     )
     resp.raise_for_status()
-    return resp.json()
+    return _loads(resp.content)
 
 
 def dd_list_events(query: str, from_ts: int, to_ts: int) -> dict:
@@ -83,24 +116,27 @@ def dd_list_events(query: str, from_ts: int, to_ts: int) -> dict:
         from_ts: Unix epoch start (seconds).
         to_ts:   Unix epoch end (seconds).
     """
-    resp = requests.get(
+    resp = _SESSION.get(
         f"{DD_BASE}/v1/events",
         headers=_headers(),
         params={"start": from_ts, "end": to_ts, "tags": query},
     )
     resp.raise_for_status()
-    return resp.json()
+    return _loads(resp.content)
 
 
-def dd_get_monitors(query: Optional[str] = None) -> list:
-    """Fetch monitors (alerts) from Datadog, optionally filtered by query.
+def dd_get_monitors(query: Optional[str] = None, page: int = 0, page_size: int = 100) -> list:
+    """Fetch one page of monitors (alerts) from Datadog, optionally filtered by query.
 
     Args:
-        query: Filter string, e.g. "tag:label:phantom" or monitor name substring.
+        query:     Filter string, e.g. "tag:label:phantom" or monitor name substring.
+        page:      Zero-based page number; request pages until one comes back empty.
+        page_size: Monitors per page (default 100, max 1000).
     """
-    params = {}
+    # Without "page" the API ignores page_size and returns every monitor
+    params = {"page": page, "page_size": page_size}
     if query:
         params["query"] = query
-    resp = requests.get(f"{DD_BASE}/v1/monitor", headers=_headers(), params=params)
+    resp = _SESSION.get(f"{DD_BASE}/v1/monitor", headers=_headers(), params=params)
     resp.raise_for_status()
-    return resp.json()
+    return _loads(resp.content)